@@ -0,0 +1,7 @@
+"""
+Benchmarks. Run them from the repository root, e.g. python -m benchmarks.attention
+Every benchmark prints its results as JSON; python -m benchmarks Model.pcl runs the whole
+suite (gru, attention, restore, decode, preprocessing, tokenizer) as a single report.
+benchmarks.distributed (scaling of data-parallel training) starts its own worker processes
+and is run on its own.
+"""
@@ -0,0 +1,53 @@
+# coding: utf-8
+"""
+Runs the whole benchmark suite and prints a single JSON report, tagged with the current git
+commit so that reports of different versions can be compared.
+
+python -m benchmarks Model.pcl [output file]
+"""
+from __future__ import division
+
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import tensorflow as tf
+
+from benchmarks import attention, decode, gru, preprocessing, restore, tokenizer
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(model_file):
+    return {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "tensorflow": tf.__version__,
+        "benchmarks": [
+            gru.run(),
+            attention.run(),
+            restore.run(model_file),
+            decode.run(model_file),
+            preprocessing.run(),
+            tokenizer.run()
+        ]
+    }
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    report = json.dumps(run(model_file), indent=2)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,71 @@
+# coding: utf-8
+"""
+Micro-benchmark of one step of the attention model of models.GRU: the previous implementation
+(tiled Wa_c, reshape+matmul scores and non-stabilised softmax over the time-major context)
+against models.attention. Reports the time per step and the peak memory of the CPU allocator.
+
+python -m benchmarks.attention [sequence length] [minibatch size] [hidden size]
+"""
+from __future__ import division
+
+from time import time
+
+import json
+import sys
+
+import tensorflow as tf
+import numpy as np
+
+import models
+
+REPEATS = 50
+
+def attention_before(context, Wa_c, ba, Wa_y, Wa_h, h_tm1):
+    # Time-major context, projected on every call as it was inside output_recurrence
+    projected_context = tf.matmul(context, tf.tile(tf.expand_dims(Wa_c, 0), tf.stack([tf.shape(context)[0], 1, 1]))) + ba
+    h_a = tf.nn.tanh(projected_context + tf.matmul(h_tm1, Wa_h))
+    alphas = tf.exp(tf.reshape(tf.matmul(tf.reshape(h_a, [-1, tf.shape(h_a)[-1]]), tf.expand_dims(Wa_y, -1)), tf.shape(h_a)[:2]))
+    alphas = alphas / tf.reduce_sum(alphas, axis=0, keepdims=True)
+    return tf.reduce_sum(context * alphas[:,:,None], axis=0)
+
+def attention_after(context, Wa_c, ba, Wa_y, Wa_h, h_tm1):
+    # Batch-major context, projected once per sequence (included here, so this is an upper bound per step)
+    attended_context = tf.transpose(context, [1, 0, 2])
+    projected_context = tf.tensordot(attended_context, Wa_c, 1) + ba
+    bias = models.attention_mask_bias(tf.ones([tf.shape(context)[1], tf.shape(context)[0]]))
+    return models.attention(attended_context, projected_context, bias, tf.matmul(h_tm1, Wa_h), Wa_y)
+
+def measure(fn, args):
+    fn = tf.function(fn)
+    fn(*args) # trace
+    tf.config.experimental.reset_memory_stats("CPU:0")
+    current = tf.config.experimental.get_memory_info("CPU:0")["current"]
+    t0 = time()
+    for _ in range(REPEATS):
+        out = fn(*args)
+    out.numpy()
+    elapsed = (time() - t0) / REPEATS
+    peak = tf.config.experimental.get_memory_info("CPU:0")["peak"] - current
+    return {"ms_per_step": elapsed * 1000, "peak_bytes": peak}, out
+
+def run(sequence_len=200, batch_size=32, n_hidden=256):
+    rng = np.random.RandomState(1)
+    n_attention = n_hidden * 2
+    uniform = lambda *shape: tf.constant(rng.uniform(-0.1, 0.1, shape).astype(np.float32))
+    args = (uniform(sequence_len, batch_size, n_attention), uniform(n_attention, n_attention), uniform(1, n_attention),
+            uniform(n_attention), uniform(n_hidden, n_attention), uniform(batch_size, n_hidden))
+
+    before, out_before = measure(attention_before, args)
+    after, out_after = measure(attention_after, args)
+
+    return {
+        "benchmark": "attention",
+        "sequence_len": sequence_len, "batch_size": batch_size, "n_hidden": n_hidden,
+        "before": before,
+        "after": after,
+        "max_abs_diff": float(np.abs(out_before.numpy() - out_after.numpy()).max())
+    }
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    print(json.dumps(run(*args), indent=2))
@@ -0,0 +1,72 @@
+# coding: utf-8
+"""
+Cost of the host-side decode stage of punctuator.restore_batch (id conversion, argmax, EOS
+search and text reconstruction) measured separately from the model calls. The input is
+restored once recording the model outputs, which are then replayed so that the second
+pass only times the decode stage.
+
+python -m benchmarks.decode Model.pcl [input file] [number of lines]
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+from time import time
+
+import json
+import sys
+
+import models, punctuator
+
+INPUT_FILE = "dataset/PunctuationTask.test.en"
+
+def run(model_file, input_file=INPUT_FILE, num_lines=None):
+    with open(input_file, encoding="utf-8") as f:
+        lines = f.readlines()[:num_lines]
+
+    with redirect_stdout(sys.stderr):
+        net, _ = models.load(model_file, None)
+
+    predict = punctuator.predict
+    outputs = []
+    model_time = [0.0]
+
+    def recording_predict(x, model, lengths=None):
+        t0 = time()
+        y = predict(x, model, lengths).numpy()
+        model_time[0] += time() - t0
+        outputs.append(y)
+        return y
+
+    replayed = iter(outputs)
+    def replaying_predict(x, model, lengths=None):
+        return next(replayed)
+
+    try:
+        punctuator.predict = recording_predict
+        t0 = time()
+        recorded = punctuator.restore_lines(lines, net)
+        total_time = time() - t0
+
+        punctuator.predict = replaying_predict
+        t0 = time()
+        replayed_lines = punctuator.restore_lines(lines, net)
+        decode_time = time() - t0
+    finally:
+        punctuator.predict = predict
+
+    assert recorded == replayed_lines
+    tokens = sum(len(line.split()) for line in lines)
+    return {
+        "benchmark": "decode",
+        "model": model_file, "lines": len(lines), "tokens": tokens, "model_calls": len(outputs),
+        "total_s": total_time,
+        "model_s": model_time[0],
+        "decode_s": decode_time,
+        "decode_tokens_per_s": tokens / max(decode_time, 1e-100)
+    }
+
+if __name__ == "__main__":
+    model_file = sys.argv[1]
+    input_file = sys.argv[2] if len(sys.argv) > 2 else INPUT_FILE
+    num_lines = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    print(json.dumps(run(model_file, input_file, num_lines), indent=2))
@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Scaling of data-parallel training (main.py --cluster): training samples/s of main.train_step
+with 1, 2, ... local worker processes (MultiWorkerMirroredStrategy on localhost), each one with
+minibatches of main.MINIBATCH_SIZE random sequences over the word vocabulary of ./punctdata.
+Not part of the suite (python -m benchmarks), as it starts its own processes.
+
+python -m benchmarks.distributed [numbers of workers] [hidden size] [sequence length] [steps]
+    e.g. python -m benchmarks.distributed 1,2,4 64 50 20
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+
+import json
+import socket
+import subprocess
+import sys
+
+WORKERS = [1, 2]
+HIDDEN_SIZE = 64
+SEQUENCE_LEN = 50
+STEPS = 20
+LEARNING_RATE = 0.02
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def worker(cluster, task, n_hidden, sequence_len, steps):
+    import tensorflow as tf
+    import numpy as np
+
+    import models, main
+    from benchmarks.timing import measure, summary
+
+    # The strategy has to be created before any other TensorFlow operation
+    main.strategy = main.make_strategy(cluster=cluster, task=task)
+    rng = np.random.RandomState(task)
+    with redirect_stdout(sys.stderr), main.strategy.scope():
+        net = models.GRU(rng, None, n_hidden)
+        main.optimizer = main.SparseAdagrad(learning_rate=LEARNING_RATE, initial_accumulator_value=1e-6)
+        main.optimizer.build(net.params)
+
+    def dataset_fn(input_context):
+        x = rng.randint(0, net.x_vocabulary_size, (sequence_len, main.MINIBATCH_SIZE)).astype(np.int32)
+        y = rng.randint(0, net.y_vocabulary_size, (sequence_len - 1, main.MINIBATCH_SIZE)).astype(np.int32)
+        return tf.data.Dataset.from_tensors((x, y)).repeat()
+    x, y = next(iter(main.strategy.distribute_datasets_from_function(dataset_fn)))
+
+    times = measure(lambda: main.train_step(net, x, y).numpy(), steps)
+    samples = int(main.num_labels(y))
+    return dict(summary(times), samples_per_step=samples, samples_per_s=samples / (sum(times) / len(times)))
+
+def run(workers=WORKERS, n_hidden=HIDDEN_SIZE, sequence_len=SEQUENCE_LEN, steps=STEPS):
+    results = {"benchmark": "distributed", "n_hidden": n_hidden, "sequence_len": sequence_len, "steps": steps, "configs": []}
+    for num_workers in workers:
+        cluster = ",".join(f"localhost:{free_port()}" for _ in range(num_workers))
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.distributed", "--worker", cluster, str(task), str(n_hidden), str(sequence_len), str(steps)],
+                stdout=subprocess.PIPE
+            )
+            for task in range(num_workers)
+        ]
+        outputs = [process.communicate()[0] for process in processes]
+        if any(process.returncode != 0 for process in processes):
+            sys.exit(f"A worker failed with {num_workers} workers")
+        # Every worker takes part in every step, the first one reports
+        results["configs"].append(dict(json.loads(outputs[0]), workers=num_workers))
+
+    baseline = results["configs"][0]["samples_per_s"] / results["configs"][0]["workers"]
+    for config in results["configs"]:
+        config["scaling_efficiency"] = config["samples_per_s"] / (baseline * config["workers"])
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        print(json.dumps(worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]), int(sys.argv[6]))))
+    else:
+        workers = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else WORKERS
+        n_hidden = int(sys.argv[2]) if len(sys.argv) > 2 else HIDDEN_SIZE
+        sequence_len = int(sys.argv[3]) if len(sys.argv) > 3 else SEQUENCE_LEN
+        steps = int(sys.argv[4]) if len(sys.argv) > 4 else STEPS
+        print(json.dumps(run(workers, n_hidden, sequence_len, steps), indent=2))
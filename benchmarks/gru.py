@@ -0,0 +1,58 @@
+# coding: utf-8
+"""
+Forward (compiled inference, models.GRU.infer) and training step (main.train_step) time of
+models.GRU over a grid of hidden sizes, minibatch sizes and sequence lengths, with random
+inputs over the word vocabulary of ./punctdata.
+
+python -m benchmarks.gru [hidden sizes] [minibatch sizes] [sequence lengths] [repeats]
+    e.g. python -m benchmarks.gru 64,256 8,32 50,200 5
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+
+import itertools
+import json
+import sys
+
+import tensorflow as tf
+import numpy as np
+
+import models, main
+from benchmarks.timing import measure, summary
+
+HIDDEN_SIZES = [64, 256]
+BATCH_SIZES = [8, main.MINIBATCH_SIZE] # training activations grow with batch*sequence_len^2 (attention)
+SEQUENCE_LENS = [50, 200]
+REPEATS = 5
+LEARNING_RATE = 0.02
+
+def run(hidden_sizes=HIDDEN_SIZES, batch_sizes=BATCH_SIZES, sequence_lens=SEQUENCE_LENS, repeats=REPEATS):
+    rng = np.random.RandomState(1)
+    results = {"benchmark": "gru", "repeats": repeats, "configs": []}
+    for n_hidden in hidden_sizes:
+        with redirect_stdout(sys.stderr):
+            net = models.GRU(rng, None, n_hidden)
+        # main.train_step applies the gradients with the optimizer of main.py
+        # (built here, as its variables can only be created on the first trace of main.train_step)
+        main.optimizer = main.SparseAdagrad(learning_rate=LEARNING_RATE, initial_accumulator_value=1e-6)
+        main.optimizer.build(net.params)
+
+        for batch_size, sequence_len in itertools.product(batch_sizes, sequence_lens):
+            x = tf.constant(rng.randint(0, net.x_vocabulary_size, (sequence_len, batch_size)), dtype=tf.int32)
+            y = tf.constant(rng.randint(0, net.y_vocabulary_size, (sequence_len - 1, batch_size)), dtype=tf.int32)
+            lengths = tf.fill([batch_size], sequence_len)
+
+            forward = summary(measure(lambda: net.infer(x, lengths).numpy(), repeats))
+            train = summary(measure(lambda: main.train_step(net, x, y).numpy(), repeats))
+            results["configs"].append({
+                "n_hidden": n_hidden, "batch_size": batch_size, "sequence_len": sequence_len,
+                "forward": dict(forward, tokens_per_s=batch_size * sequence_len / (forward["mean_ms"] / 1000)),
+                "train_step": dict(train, tokens_per_s=batch_size * sequence_len / (train["mean_ms"] / 1000))
+            })
+    return results
+
+if __name__ == "__main__":
+    sizes = lambda i, default: [int(s) for s in sys.argv[i].split(",")] if len(sys.argv) > i else default
+    repeats = int(sys.argv[4]) if len(sys.argv) > 4 else REPEATS
+    print(json.dumps(run(sizes(1, HIDDEN_SIZES), sizes(2, BATCH_SIZES), sizes(3, SEQUENCE_LENS), repeats), indent=2))
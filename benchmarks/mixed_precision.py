@@ -0,0 +1,83 @@
+# coding: utf-8
+"""
+Mixed precision (models.set_compute_dtype, --bf16 in main.py and punctuator.py) against float32:
+validation perplexity and evaluation throughput over the shipped dev set, and training step
+throughput (main.train_step) over its first minibatches. Every mode starts from the weights of
+the model file.
+
+python -m benchmarks.mixed_precision Model.pcl [dev set file] [training steps]
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+from time import time
+
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import models, data, main
+from benchmarks.timing import measure, summary
+
+DEV_SET_FILE = "data_input/processed_text.dev.txt"
+MODES = ["float32", models.BFLOAT16]
+TRAIN_STEPS = 10
+LEARNING_RATE = 0.02
+
+def run(model_file, dev_set_file=DEV_SET_FILE, train_steps=TRAIN_STEPS):
+    workdir = tempfile.mkdtemp()
+    dev_file = os.path.join(workdir, "dev")
+    try:
+        with redirect_stdout(sys.stderr):
+            data.write_processed_dataset([dev_set_file], dev_file)
+        num_subsequences = len(data.read_processed_dataset(dev_file))
+
+        dev_dataset = main.make_dataset([dev_file], main.EVAL_BATCH_SIZE, shuffle=False, drop_remainder=False)
+        train_minibatches = list(itertools.islice(main.make_dataset([dev_file], main.MINIBATCH_SIZE, shuffle=False), train_steps))
+
+        results = {"benchmark": "mixed_precision", "model": model_file, "dev_set": dev_set_file,
+                   "subsequences": num_subsequences, "modes": {}}
+        for mode in MODES:
+            with redirect_stdout(sys.stderr):
+                net, _ = models.load(model_file, None)
+                models.set_compute_dtype(net, mode)
+
+            main.evaluate(net, dev_dataset.take(1)) # traces eval_step
+            t0 = time()
+            neg_log_likelihood, num_labels = main.evaluate(net, dev_dataset)
+            eval_time = time() - t0
+
+            main.optimizer = main.SparseAdagrad(learning_rate=LEARNING_RATE, initial_accumulator_value=1e-6)
+            main.optimizer.build(net.params)
+            steps = itertools.cycle(train_minibatches)
+            train = summary(measure(lambda: main.train_step(net, *next(steps)).numpy(), len(train_minibatches)))
+            tokens_per_step = np.prod(train_minibatches[0][0].shape)
+
+            results["modes"][mode] = {
+                "validation_ppl": float(np.exp(neg_log_likelihood / num_labels)),
+                "eval_s": eval_time,
+                "eval_tokens_per_s": float(num_labels / eval_time),
+                "train_step": dict(train, tokens_per_s=float(tokens_per_step / (train["mean_ms"] / 1000)))
+            }
+
+        reference = results["modes"]["float32"]
+        for mode in results["modes"].values():
+            mode["validation_ppl_delta"] = mode["validation_ppl"] - reference["validation_ppl"]
+            mode["eval_speedup"] = mode["eval_tokens_per_s"] / reference["eval_tokens_per_s"]
+            mode["train_speedup"] = mode["train_step"]["tokens_per_s"] / reference["train_step"]["tokens_per_s"]
+
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Model file path argument missing")
+    dev_set_file = sys.argv[2] if len(sys.argv) > 2 else DEV_SET_FILE
+    train_steps = int(sys.argv[3]) if len(sys.argv) > 3 else TRAIN_STEPS
+    print(json.dumps(run(sys.argv[1], dev_set_file, train_steps), indent=2))
@@ -0,0 +1,62 @@
+# coding: utf-8
+"""
+Speed of the data preparation stages: process_text.process_line (tokens/s over a raw text
+file) and data.write_processed_dataset (MB/s of processed text vectorised with the
+vocabularies of ./punctdata).
+
+python -m benchmarks.preprocessing [raw text file] [processed text file]
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+from time import perf_counter
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import data
+from process_text import process_line
+
+RAW_FILE = "dataset/PunctuationTask.test.en"
+PROCESSED_FILE = "data_input/processed_text.dev.txt"
+
+def run_process_line(raw_file=RAW_FILE):
+    with open(raw_file, encoding="utf-8") as f:
+        lines = f.readlines()
+
+    t0 = perf_counter()
+    tokens = sum(len(process_line(line).split()) for line in lines)
+    elapsed = perf_counter() - t0
+
+    return {"file": raw_file, "lines": len(lines), "output_tokens": tokens, "seconds": elapsed,
+            "lines_per_s": len(lines) / elapsed, "tokens_per_s": tokens / elapsed}
+
+def run_write_processed_dataset(processed_file=PROCESSED_FILE):
+    workdir = tempfile.mkdtemp()
+    try:
+        t0 = perf_counter()
+        with redirect_stdout(sys.stderr):
+            data.write_processed_dataset([processed_file], os.path.join(workdir, "dataset"))
+        elapsed = perf_counter() - t0
+        subsequences = len(data.read_processed_dataset(os.path.join(workdir, "dataset")))
+    finally:
+        shutil.rmtree(workdir)
+
+    size = os.path.getsize(processed_file) / 1e6
+    return {"file": processed_file, "megabytes": size, "subsequences": subsequences, "seconds": elapsed,
+            "mb_per_s": size / elapsed}
+
+def run(raw_file=RAW_FILE, processed_file=PROCESSED_FILE):
+    return {
+        "benchmark": "preprocessing",
+        "process_line": run_process_line(raw_file),
+        "write_processed_dataset": run_write_processed_dataset(processed_file)
+    }
+
+if __name__ == "__main__":
+    raw_file = sys.argv[1] if len(sys.argv) > 1 else RAW_FILE
+    processed_file = sys.argv[2] if len(sys.argv) > 2 else PROCESSED_FILE
+    print(json.dumps(run(raw_file, processed_file), indent=2))
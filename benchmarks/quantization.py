@@ -0,0 +1,83 @@
+# coding: utf-8
+"""
+Accuracy, size and speed of the quantized inference modes (models.quantize) against float32.
+Restores the test set with each mode, converts the output as write_to_file2.py does and
+evaluates it with error_calculator.compute_error against the ground truth.
+
+python -m benchmarks.quantization Model.pcl [input file] [ground truth file] [number of lines]
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+from time import time
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import models, punctuator
+from error_calculator import compute_error
+from process_text import process_line2, clear_endbreak_line
+
+INPUT_FILE = "dataset/PunctuationTask.test.en"
+GROUND_TRUTH_FILE = "data_check/processed_text.test.txt"
+MODES = [None, models.FLOAT16, models.INT8]
+
+def run(model_file, input_file=INPUT_FILE, ground_truth_file=GROUND_TRUTH_FILE, num_lines=None):
+    with open(input_file, encoding="utf-8") as f:
+        lines = f.readlines()[:num_lines]
+    with open(ground_truth_file, encoding="utf-8") as f:
+        ground_truth = f.readlines()[:len(lines)]
+
+    workdir = tempfile.mkdtemp()
+    try:
+        target_path = os.path.join(workdir, "target.txt")
+        with open(target_path, "w", encoding="utf-8") as f:
+            f.writelines(ground_truth)
+
+        results = {"benchmark": "quantization", "model": model_file, "lines": len(lines), "modes": {}}
+        for mode in MODES:
+            with redirect_stdout(sys.stderr):
+                net, _ = models.load(model_file, None)
+                if mode is not None:
+                    models.quantize(net, mode)
+
+            reverse_punctuation_vocabulary = {v:k for k,v in net.y_vocabulary.items()}
+            texts = [punctuator.prepare_line(line, net.y_vocabulary) for line in lines]
+
+            t0 = time()
+            restored = punctuator.restore_batch(texts, net.x_vocabulary, reverse_punctuation_vocabulary, net)
+            elapsed = time() - t0
+
+            predicted_path = os.path.join(workdir, "%s.txt" % (mode or "float32"))
+            with open(predicted_path, "w", encoding="utf-8") as f:
+                for line in restored:
+                    f.write(clear_endbreak_line(process_line2(clear_endbreak_line(line))) + "\n")
+
+            with redirect_stdout(sys.stderr):
+                metrics = compute_error([target_path], [predicted_path])
+
+            results["modes"][mode or "float32"] = {
+                "weights_bytes": models.weights_size(net),
+                "lines_per_second": len(lines) / elapsed,
+                "metrics": metrics
+            }
+
+        reference = results["modes"]["float32"]["metrics"]
+        for mode in results["modes"].values():
+            mode["f_score_delta"] = {
+                p: mode["metrics"][p]["f_score"] - reference[p]["f_score"]
+                for p in reference if isinstance(reference[p], dict)
+            }
+
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Model file path argument missing")
+    args = sys.argv[1:4] + [int(sys.argv[4])] if len(sys.argv) > 4 else sys.argv[1:]
+    print(json.dumps(run(*args), indent=2, default=float))
@@ -0,0 +1,58 @@
+# coding: utf-8
+"""
+Punctuation restoration speed of punctuator.restore_lines: throughput (lines/s and tokens/s)
+restoring the input in chunks of punctuator.LINES_PER_CHUNK lines, and p50/p99 latency of
+single-line requests.
+
+python -m benchmarks.restore Model.pcl [input file] [number of lines] [latency requests]
+"""
+from __future__ import division
+
+from contextlib import redirect_stdout
+from time import perf_counter
+
+import json
+import sys
+
+import models, punctuator
+from benchmarks.timing import summary
+
+INPUT_FILE = "dataset/PunctuationTask.test.en"
+LATENCY_REQUESTS = 200
+
+def run(model_file, input_file=INPUT_FILE, num_lines=None, latency_requests=LATENCY_REQUESTS):
+    with open(input_file, encoding="utf-8") as f:
+        lines = f.readlines()[:num_lines]
+
+    with redirect_stdout(sys.stderr):
+        net, _ = models.load(model_file, None)
+
+    # Warm-up: models.GRU.infer is already traced by models.load, this fills the runtime's
+    # kernel caches and thread pools before timing
+    punctuator.restore_lines(lines[:punctuator.BATCH_SIZE], net)
+
+    t0 = perf_counter()
+    for i in range(0, len(lines), punctuator.LINES_PER_CHUNK):
+        punctuator.restore_lines(lines[i:i + punctuator.LINES_PER_CHUNK], net)
+    elapsed = perf_counter() - t0
+
+    latencies = []
+    for line in lines[:latency_requests]:
+        t0 = perf_counter()
+        punctuator.restore_lines([line], net)
+        latencies.append(perf_counter() - t0)
+
+    tokens = sum(len(line.split()) for line in lines)
+    return {
+        "benchmark": "restore",
+        "model": model_file, "lines": len(lines), "tokens": tokens,
+        "throughput": {"seconds": elapsed, "lines_per_s": len(lines) / elapsed, "tokens_per_s": tokens / elapsed},
+        "single_line_latency": summary(latencies)
+    }
+
+if __name__ == "__main__":
+    model_file = sys.argv[1]
+    input_file = sys.argv[2] if len(sys.argv) > 2 else INPUT_FILE
+    num_lines = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    latency_requests = int(sys.argv[4]) if len(sys.argv) > 4 else LATENCY_REQUESTS
+    print(json.dumps(run(model_file, input_file, num_lines, latency_requests), indent=2))
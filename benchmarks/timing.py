@@ -0,0 +1,32 @@
+# coding: utf-8
+"""
+Timing helpers shared by the benchmarks.
+"""
+from __future__ import division
+
+from time import perf_counter
+
+import numpy as np
+
+def measure(fn, repeats, warm_up=1):
+    """
+    Calls fn() warm_up times (tracing, caches) and then repeats times, returning the wall time
+    of each timed call in seconds.
+    """
+    for _ in range(warm_up):
+        fn()
+    times = []
+    for _ in range(repeats):
+        t0 = perf_counter()
+        fn()
+        times.append(perf_counter() - t0)
+    return times
+
+def summary(times):
+    times = np.asarray(times)
+    return {
+        "calls": len(times),
+        "mean_ms": float(times.mean() * 1000),
+        "p50_ms": float(np.percentile(times, 50) * 1000),
+        "p99_ms": float(np.percentile(times, 99) * 1000)
+    }
@@ -0,0 +1,113 @@
+# coding: utf-8
+"""
+Conformance check and benchmark of the regex tokenizers of process_text (tokenize, tokenize2
+and, through them, process_line and process_line2) against the previous character-by-character
+implementation, over every line of the shipped dataset/ and data_input/ files. Exits with an
+error if any line is tokenized differently.
+
+python -m benchmarks.tokenizer [files...]
+"""
+from __future__ import division
+
+from time import perf_counter
+
+import glob
+import json
+import sys
+
+import process_text
+
+FILES = sorted(glob.glob("dataset/*") + glob.glob("data_input/*"))
+
+def tokenize_before(sent, puncts=[',', '.', ';', ':', '?', '!']):
+    res = []
+    partial = ''
+    cur_read_type = None
+    for c_i in sent:
+        if c_i == ' ' or c_i in puncts:
+            res += list(filter(lambda x: x.strip() != '', [partial.lower(), c_i]))
+            partial = ''
+            cur_read_type = None
+        else:
+            if c_i.isdigit():
+                if cur_read_type == 'string':
+                    res += [partial.lower()]
+                    partial = ''
+                cur_read_type = 'number'
+            else:
+                if cur_read_type == 'number':
+                    res += [partial.lower()]
+                    partial = ''
+                cur_read_type = 'string'
+            partial += c_i
+    res += [partial.lower()] if partial.strip() != '' else []
+    return res
+
+def tokenize2_before(sent, puncts={".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON",
+        ":": ":COLON", "?": "?QUESTIONMARK", "!": "!EXCLAMATIONMARK"}):
+    res = []
+    partial = ''
+    cur_read_type = None
+    for c_i in sent:
+        if c_i == ' ' or c_i in puncts:
+            if partial:
+                res.append(partial)
+            res.append(puncts[c_i] if c_i != ' ' else c_i)
+            partial = ''
+            cur_read_type = None
+        else:
+            if c_i.isdigit():
+                if cur_read_type == 'string':
+                    res += [partial]
+                    partial = ''
+                cur_read_type = 'number'
+            else:
+                if cur_read_type == 'number':
+                    res += [partial]
+                    partial = ''
+                cur_read_type = 'string'
+            partial += c_i
+    res += [partial] if partial.strip() != '' else []
+    return res
+
+# Edge cases not necessarily present in the files (whitespace other than spaces, non-decimal digits)
+EXTRA_LINES = ["", " ", "a", "1", "a1b2", "x\t1", "x\t.y", "\t", "a \t", "\t1", "²3 x²", "٣4a", "hello,world 12.5?!  ", "İstanbul 1st"]
+
+def run(files=FILES):
+    lines = list(EXTRA_LINES)
+    for file_name in files:
+        with open(file_name, encoding="utf-8") as f:
+            lines += f.readlines()
+    stripped = [line.strip() for line in lines]
+
+    mismatches = {}
+    for name, before, after in [("tokenize", tokenize_before, process_text.tokenize), ("tokenize2", tokenize2_before, process_text.tokenize2)]:
+        mismatches[name] = sum(before(line) != after(line) for line in lines + stripped)
+
+    results = {"benchmark": "tokenizer", "files": files, "lines": len(lines), "tokens": sum(len(line.split()) for line in lines), "mismatches": mismatches}
+    for name, before, after in [("tokenize", tokenize_before, process_text.tokenize), ("tokenize2", tokenize2_before, process_text.tokenize2)]:
+        t0 = perf_counter()
+        for line in stripped:
+            before(line)
+        before_s = perf_counter() - t0
+        t0 = perf_counter()
+        for line in stripped:
+            after(line)
+        after_s = perf_counter() - t0
+        results[name] = {"before_s": before_s, "after_s": after_s, "speedup": before_s / after_s,
+                         "tokens_per_s": results["tokens"] / after_s}
+
+    for name, process in [("process_line", process_text.process_line), ("process_line2", process_text.process_line2)]:
+        t0 = perf_counter()
+        for line in lines:
+            process(line)
+        elapsed = perf_counter() - t0
+        results[name] = {"seconds": elapsed, "tokens_per_s": results["tokens"] / elapsed}
+
+    return results
+
+if __name__ == "__main__":
+    results = run(sys.argv[1:] or FILES)
+    print(json.dumps(results, indent=2))
+    if any(results["mismatches"].values()):
+        sys.exit("The tokenizers differ from the previous implementation")
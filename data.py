@@ -5,10 +5,17 @@ from __future__ import division
 import random
 import os
 import sys
-import operator
 import pickle
 import codecs
 import fnmatch
+import glob
+import heapq
+import multiprocessing
+from collections import Counter
+
+from preprocess import read_chunks, bounded_imap, get_option
+
+import numpy as np
 
 # PARÁMETROS DEL SCRIPT
 
@@ -31,6 +38,13 @@ MAX_WORD_VOCABULARY_SIZE = 100000
 # entrenamiento
 MIN_WORD_COUNT_IN_VOCAB = 2
 
+# Número de líneas de cada bloque en el recuento (paralelo) de ocurrencias de los términos
+LINES_PER_COUNT_CHUNK = 10000
+
+# Tamaño máximo aproximado (en bytes de texto) de la entrada de cada fragmento de un 
+# conjunto vectorizado por fragmentos (ver write_processed_dataset_shards)
+SHARD_BYTES = 64 * 1024 * 1024
+
 # Longitud máxima de la frase
 MAX_SEQUENCE_LEN = 200
 
@@ -39,6 +53,13 @@ MAX_SEQUENCE_LEN = 200
 TRAIN_FILE = os.path.join(DATA_PATH, "train")
 DEV_FILE = os.path.join(DATA_PATH, "dev")
 
+# Extensiones de los ficheros binarios de cada conjunto vectorizado: los ids de los términos y
+# de las puntuaciones de todas las subsecuencias (int32, concatenados) y el índice con la 
+# posición de inicio de cada subsecuencia en el fichero de términos (int64)
+WORDS_EXT = ".words.bin"
+PUNCTUATIONS_EXT = ".punctuations.bin"
+INDEX_EXT = ".index.bin"
+
 # Ficheros del directorio de salida en los que se guardarán los vocabularios de
 # términos y símbolos de puntuación
 WORD_VOCAB_FILE = os.path.join(DATA_PATH, "vocabulary")
@@ -95,6 +116,56 @@ def add_counts(word_counts, line):
         # En otro caso, se contabiliza la ocurrencia para el término correspondiente
         word_counts[w] = word_counts.get(w, 0) + 1
 
+# Función de recuento de las ocurrencias de los términos de un bloque de líneas
+def count_words(lines):
+    """
+      Versión de add_counts para un bloque de líneas, que devuelve un contador nuevo
+      (los términos aparecen en él en el orden de su primera ocurrencia).
+    """
+    # Tokens que no corresponden a términos
+    excluded = set(CRAP_TOKENS) | set(PUNCTUATION_VOCABULARY) | set(PUNCTUATION_MAPPING)
+    return Counter([w for line in lines for w in line.split() if w not in excluded])
+
+# Función de recuento (en paralelo) de las ocurrencias de los términos de varios ficheros
+def build_word_counts(file_names, workers=1, chunk_size=LINES_PER_COUNT_CHUNK):
+    """
+      Cuenta las ocurrencias de los términos de los ficheros dados. Los ficheros se leen
+      por bloques de líneas, que se cuentan en paralelo (count_words) en workers procesos,
+      y los recuentos parciales se acumulan en el orden de los bloques, por lo que el
+      resultado es el mismo que el de aplicar add_counts a cada línea en orden (incluido
+      el orden de primera ocurrencia de los términos, que desempata en create_vocabulary).
+
+      Parámetros
+      ----------
+      file_names : list(str)
+          Las rutas de los ficheros de texto tokenizado
+
+      workers : int, optional
+          Número de procesos. Por defecto 1 (en el propio proceso)
+
+      chunk_size : int, optional
+          Número de líneas de cada bloque. Por defecto LINES_PER_COUNT_CHUNK
+
+      Salida
+      ------
+        collections.Counter
+          El número de ocurrencias de cada término.
+    """
+    def chunks():
+        for file_name in file_names:
+            with codecs.open(file_name, "r", "utf-8") as text:
+                yield from read_chunks(text, chunk_size)
+
+    word_counts = Counter()
+    if workers <= 1:
+        for chunk in chunks():
+            word_counts.update(count_words(chunk))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for partial_counts in bounded_imap(pool, count_words, chunks(), 2 * workers):
+                word_counts.update(partial_counts)
+    return word_counts
+
 # Función para la creación del vocabulario a partir de los términos y su número de
 # ocurrencias
 def create_vocabulary(word_counts):
@@ -107,24 +178,25 @@ def create_vocabulary(word_counts):
       word_counts : dict(str, int)
 
           Un diccionario (o similar) que contiene la cuenta de las ocurrencias de 
-          cada uno de los términos hasta el momento. ¡ES MODIFICADO!
+          cada uno de los términos, en el orden de su primera ocurrencia.
 
       Salida
       ------
-        None
-          Modifica el diccionario pasado como parámetro añadiendo la cuenta de las
-          ocurrencias de las palabras de la frase.
+        list(str)
+          Los términos del vocabulario, de mayor a menor número de ocurrencias (a igualdad
+          de ocurrencias, el que apareció más tarde primero), seguidos de END y UNK.
     """
 
     # Se constuye el vocabulario con los MAX_WORD_VOCABULARY_SIZE términos con más
-    #ocurrencias que poseen más de las ocurrencias mínimas
-    vocabulary = [
-        wc[0]
-        for wc in reversed(sorted(word_counts.items(), key=operator.itemgetter(1)))
-        if wc[1] >= MIN_WORD_COUNT_IN_VOCAB and wc[0] != UNK
-    ][
-        :MAX_WORD_VOCABULARY_SIZE
-    ]  # Unk will be appended to end
+    # ocurrencias que poseen más de las ocurrencias mínimas. Sólo se ordenan los 
+    # seleccionados (heap), con el mismo orden que la ordenación estable (invertida) 
+    # de todos los términos por número de ocurrencias
+    candidates = [
+        (-count, -i, w)
+        for i, (w, count) in enumerate(word_counts.items())
+        if count >= MIN_WORD_COUNT_IN_VOCAB and w != UNK
+    ]
+    vocabulary = [w for _, _, w in heapq.nsmallest(MAX_WORD_VOCABULARY_SIZE, candidates)]  # Unk will be appended to end
 
     # END Y UNK se añaden también al vocabulario.
     vocabulary.append(END)
@@ -153,35 +225,146 @@ def write_vocabulary(vocabulary, file_name):
         f.write("\n".join(vocabulary))
 
 
-def write_processed_dataset(input_files, output_file):
+class ProcessedDatasetWriter(object):
     """
-      Función para el procesamiento de los datos de los ficheros, para su vectorización
-      de acuerdo al vocabulario de palabras y el de puntuaciones, generando los datos
-      de entrenamiento y validación para el modelo.
-      
+      Escritura incremental de un conjunto vectorizado en formato binario. Cada 
+      subsecuencia se vuelca a disco en cuanto se añade, por lo que no es necesario
+      mantener el conjunto completo en memoria.
+
       Parámetros
       ----------
-      input_files : list(str)
-        Contiene las rutas de los ficheros correspondientes al conjunto de ejemplos
-        procesado (entrenamiento o validación)
-      
       output_file : str
-        Ruta al fichero donde se guardarán las vectorizaciones de los datos procesados
+        Ruta base de los ficheros del conjunto (se le añaden WORDS_EXT, PUNCTUATIONS_EXT
+        e INDEX_EXT)
+    """
 
-      Salida
-      ------
-        None
-        
-        Escribe los ficheros correspondientes.
+    def __init__(self, output_file):
+        self.words = open(output_file + WORDS_EXT, "wb")
+        self.punctuations = open(output_file + PUNCTUATIONS_EXT, "wb")
+        self.index = open(output_file + INDEX_EXT, "wb")
+
+        # El índice comienza con la posición de la primera subsecuencia
+        self.offset = 0
+        self.index.write(np.array([self.offset], dtype=np.int64).tobytes())
+
+    def append(self, words, punctuations):
+        # Una subsecuencia de n términos tiene n - 1 puntuaciones
+        assert len(words) == len(punctuations) + 1
+
+        self.words.write(np.asarray(words, dtype=np.int32).tobytes())
+        self.punctuations.write(np.asarray(punctuations, dtype=np.int32).tobytes())
+
+        self.offset += len(words)
+        self.index.write(np.array([self.offset], dtype=np.int64).tobytes())
+
+    def close(self):
+        self.words.close()
+        self.punctuations.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _memmap(file_name, dtype):
+    # np.memmap no admite ficheros vacíos
+    if os.path.getsize(file_name) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode="r")
+
+
+class ProcessedDataset(object):
+    """
+      Conjunto vectorizado en formato binario, proyectado en memoria (memory-mapped):
+      las subsecuencias se leen de disco sólo cuando se accede a ellas.
+
+      Parámetros
+      ----------
+      file_name : str
+        Ruta base de los ficheros del conjunto
     """
 
-    # Se inicializa una lista vacía que almacenará las vectorizaciones de las frases 
-    # se han hecho hasta el momento
-    data = []
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.offsets = np.fromfile(file_name + INDEX_EXT, dtype=np.int64)
+        self.words = _memmap(file_name + WORDS_EXT, np.int32)
+        self.punctuations = _memmap(file_name + PUNCTUATIONS_EXT, np.int32)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        # Las puntuaciones de la subsecuencia i-ésima empiezan i posiciones antes que sus
+        # términos, pues cada una de las subsecuencias anteriores tiene una puntuación menos
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.words[start:end], self.punctuations[start - i:end - i - 1]
+
+
+def stack_subsequences(subsequences):
+    """
+      Devuelve las subsecuencias (pares de términos y puntuaciones) dadas como un par de
+      matrices (X, Y) de tamaños [longitud, len(subsequences)] y [longitud - 1, len(subsequences)]
+      (el primer eje es el tiempo, tal y como lo espera el modelo)
+    """
+    X = np.stack([words for words, _ in subsequences], axis=1)
+    Y = np.stack([punctuations for _, punctuations in subsequences], axis=1)
+    return X, Y
+
+
+def convert_pickled_dataset(file_name):
+    """
+      Convierte un conjunto vectorizado con el formato anterior (la lista de subsecuencias
+      serializada con pickle en file_name) al formato binario.
+    """
+    with open(file_name, "rb") as f:
+        dataset = pickle.load(f)
+
+    with ProcessedDatasetWriter(file_name) as writer:
+        for words, punctuations in dataset:
+            writer.append(words, punctuations)
 
-    # Se leen los vocabularios de términos y puntuaciones
-    word_vocabulary = read_vocabulary(WORD_VOCAB_FILE)
-    punctuation_vocabulary = read_vocabulary(PUNCT_VOCAB_FILE)
+
+def read_processed_dataset(file_name):
+    """
+      Abre el conjunto vectorizado file_name. Si sólo existe en el formato anterior 
+      (pickle) se convierte previamente al formato binario.
+    """
+    if not os.path.exists(file_name + INDEX_EXT) and os.path.isfile(file_name):
+        print("Converting %s to the binary dataset format" % file_name)
+        convert_pickled_dataset(file_name)
+
+    return ProcessedDataset(file_name)
+
+
+def vectorize_tokens(tokens, writer, word_vocabulary, punctuation_vocabulary):
+    """
+      Vectoriza una secuencia de tokens (de uno o varios ficheros de texto procesado) de
+      acuerdo al vocabulario de palabras y al de puntuaciones, y escribe las subsecuencias
+      resultantes (de como mucho MAX_SEQUENCE_LEN términos, terminadas en un signo de final
+      de frase) en el escritor dado.
+
+      Parámetros
+      ----------
+      tokens : iterable(str)
+        Los tokens, en orden
+
+      writer : ProcessedDatasetWriter
+        El escritor del conjunto vectorizado
+
+      word_vocabulary : dict(str,int)
+        Vocabulario de términos
+
+      punctuation_vocabulary : dict(str,int)
+        Vocabulario de puntuaciones
+
+      Salida
+      ------
+        (int, int)
+          El número total de términos leídos y el de términos desconocidos (UNK).
+    """
 
     # Se inicializan dos contadores que reflejan el número total de tokens leídos
     # y el número de tokens que son UNK (sólo para datos para el usuario)
@@ -208,135 +391,264 @@ def write_processed_dataset(input_files, output_file):
     # frase (no de línea) para considerar una nueva frase (para el caso de las fragmentaciones)
     skip_until_eos = False  
 
-    # Para cada token de cada linea de cada archivo
-    for input_file in input_files:
-        with codecs.open(input_file, "r", "utf-8") as text:
-            for line in text:
-                for token in line.split():
-
-                    # Si el token es de puntuación y ha de ser mapeado a otro entonces se hace el mapeo
-                    if token in PUNCTUATION_MAPPING:
-                        token = PUNCTUATION_MAPPING[token]
-
-                    # Si no se debe empezar la frase hasta un símbolo de final de frase
-                    if skip_until_eos:
-                        # si se lee un nuevo símbolo de final de frase, se desactiva el supervisor
-                        # y, en el siguiente paso empezará la lectura de una nueva frase
-                        if token in EOS_TOKENS:
-                            skip_until_eos = False
-
-                        # en otro caso el token se descarta y se sigue esperando la llegada de un
-                        # token de final de frase.
-                        continue
-
-                    # en otro caso (se está en procesamiento activo de la frase)
-
-                    # Si el token pertenece a los descartables, se descarta
-                    elif token in CRAP_TOKENS:
-                        continue
-
-                    # Si el token corresponde a un signo de puntuación
-                    elif token in punctuation_vocabulary:
-
-                        # Si el anterior token también era de puntuación, entonces el nuevo se descarta
-                        if last_token_was_punctuation:
-                            continue
-
-                        # En otro caso, si el token corresponde a un token de final de frase, se actualiza
-                        # la referencia del último token de final de frase
-                        if token in EOS_TOKENS:
-                            last_eos_idx = len(current_punctuations)
-
-                        # Se añade el id (entero, int) correspondiente al token de puntuación, según el 
-                        # vocabulario de puntuaciones
-                        punctuation = punctuation_vocabulary[token]
-
-                        # al vector (lista) de puntuaciones de la frase
-                        current_punctuations.append(punctuation)
-
-                        # se activa la marca de último token puntuación
-                        last_token_was_punctuation = True
-
-                    # En otro caso, si es un término (no una puntuación)
-                    else:
-                        # Si el último token procesado era también un término, entonces corresponde 
-                        # añadir el símbolo de espacio como símbolo de puntuación.
-                        if not last_token_was_punctuation:
-                            current_punctuations.append(punctuation_vocabulary[SPACE])
-
-                        # Se toma el id (entero, int) correspondiente al término procesado, según el
-                        # vocabulario de palabras. Si no aparece se marca como UNK (con el id corresp.)
-                        word = word_vocabulary.get(token, word_vocabulary[UNK])
-
-                        # Se añade el id correspondiente al término al vector de palabras correspondiente a
-                        # la frase actual
-                        current_words.append(word)
-                        
-                        # Se desactiva la marca de último término puntuación.
-                        last_token_was_punctuation = False
-
-                        # Se incrementa el número total de términos procesados
-                        num_total += 1
-
-                        # Y se incrementa el número total de UNKs, si procede
-                        num_unks += int(word == word_vocabulary[UNK])
-
-                    # Si se ha llegado al tamaño de secuencia máxima, 
-                    if ( len(current_words) == MAX_SEQUENCE_LEN ):  
-
-                        # Entonces el último token procesado corresponde a un término (y no a un símbolo de puntuación)
-                        # de donde se sigue inmediatamente que, como se inicia con la lectura de un término y se van intercalando
-                        # términos y símbolos de puntuación, entonces debe haber un símbolo de puntuación menos que el número de 
-                        # términos
-                        assert len(current_words) == len(current_punctuations) + 1, (
-                            "#words: %d; #punctuations: %d"
-                            % (len(current_words), len(current_punctuations))
-                        )
-
-                        # Si la referencia del último signo de puntuación es 0, entonces la frase es demasiado larga,
-                        # luego se descarta y se empieza a intentar leer una nueva. (Considere aumentar el tamaño de secuencia)
-                        if last_eos_idx == 0:
-                            skip_until_eos = True
-
-                            current_words = []
-                            current_punctuations = []
-
-                            last_token_was_punctuation = True 
-                        
-                        # En otro caso, se añade la secuencia como secuencia de entrenamiento
-                        else:
-                            # Para ello se toman los términos procesados de las secuencias, sustituyendo la última por un END
-                            # y el número de puntuaciones. Este par configura un ejemplo del conjunto de entrenamiento o validación
-                            subsequence = [
-                                current_words[:-1] + [word_vocabulary[END]],
-                                current_punctuations
-                            ]
-
-                            data.append(subsequence)
-
-                            # Comenzamos la lectura de la siguiente frase desde el último signo de puntuación leído.
-                            current_words = current_words[last_eos_idx + 1 :]
-                            current_punctuations = current_punctuations[
-                                last_eos_idx + 1 :
-                            ]
-
-                        last_eos_idx = 0  # sequence always starts with a new sentence
+    # Para cada token
+    for token in tokens:
+
+        # Si el token es de puntuación y ha de ser mapeado a otro entonces se hace el mapeo
+        if token in PUNCTUATION_MAPPING:
+            token = PUNCTUATION_MAPPING[token]
+
+        # Si no se debe empezar la frase hasta un símbolo de final de frase
+        if skip_until_eos:
+            # si se lee un nuevo símbolo de final de frase, se desactiva el supervisor
+            # y, en el siguiente paso empezará la lectura de una nueva frase
+            if token in EOS_TOKENS:
+                skip_until_eos = False
+
+            # en otro caso el token se descarta y se sigue esperando la llegada de un
+            # token de final de frase.
+            continue
+
+        # en otro caso (se está en procesamiento activo de la frase)
+
+        # Si el token pertenece a los descartables, se descarta
+        elif token in CRAP_TOKENS:
+            continue
+
+        # Si el token corresponde a un signo de puntuación
+        elif token in punctuation_vocabulary:
+
+            # Si el anterior token también era de puntuación, entonces el nuevo se descarta
+            if last_token_was_punctuation:
+                continue
+
+            # En otro caso, si el token corresponde a un token de final de frase, se actualiza
+            # la referencia del último token de final de frase
+            if token in EOS_TOKENS:
+                last_eos_idx = len(current_punctuations)
+
+            # Se añade el id (entero, int) correspondiente al token de puntuación, según el 
+            # vocabulario de puntuaciones
+            punctuation = punctuation_vocabulary[token]
+
+            # al vector (lista) de puntuaciones de la frase
+            current_punctuations.append(punctuation)
+
+            # se activa la marca de último token puntuación
+            last_token_was_punctuation = True
+
+        # En otro caso, si es un término (no una puntuación)
+        else:
+            # Si el último token procesado era también un término, entonces corresponde 
+            # añadir el símbolo de espacio como símbolo de puntuación.
+            if not last_token_was_punctuation:
+                current_punctuations.append(punctuation_vocabulary[SPACE])
+
+            # Se toma el id (entero, int) correspondiente al término procesado, según el
+            # vocabulario de palabras. Si no aparece se marca como UNK (con el id corresp.)
+            word = word_vocabulary.get(token, word_vocabulary[UNK])
+
+            # Se añade el id correspondiente al término al vector de palabras correspondiente a
+            # la frase actual
+            current_words.append(word)
+            
+            # Se desactiva la marca de último término puntuación.
+            last_token_was_punctuation = False
+
+            # Se incrementa el número total de términos procesados
+            num_total += 1
+
+            # Y se incrementa el número total de UNKs, si procede
+            num_unks += int(word == word_vocabulary[UNK])
+
+        # Si se ha llegado al tamaño de secuencia máxima, 
+        if ( len(current_words) == MAX_SEQUENCE_LEN ):  
+
+            # Entonces el último token procesado corresponde a un término (y no a un símbolo de puntuación)
+            # de donde se sigue inmediatamente que, como se inicia con la lectura de un término y se van intercalando
+            # términos y símbolos de puntuación, entonces debe haber un símbolo de puntuación menos que el número de 
+            # términos
+            assert len(current_words) == len(current_punctuations) + 1, (
+                "#words: %d; #punctuations: %d"
+                % (len(current_words), len(current_punctuations))
+            )
+
+            # Si la referencia del último signo de puntuación es 0, entonces la frase es demasiado larga,
+            # luego se descarta y se empieza a intentar leer una nueva. (Considere aumentar el tamaño de secuencia)
+            if last_eos_idx == 0:
+                skip_until_eos = True
+
+                current_words = []
+                current_punctuations = []
+
+                last_token_was_punctuation = True 
+            
+            # En otro caso, se añade la secuencia como secuencia de entrenamiento
+            else:
+                # Para ello se toman los términos procesados de las secuencias, sustituyendo la última por un END
+                # y el número de puntuaciones. Este par configura un ejemplo del conjunto de entrenamiento o validación
+                writer.append(current_words[:-1] + [word_vocabulary[END]], current_punctuations)
+
+                # Comenzamos la lectura de la siguiente frase desde el último signo de puntuación leído.
+                current_words = current_words[last_eos_idx + 1 :]
+                current_punctuations = current_punctuations[
+                    last_eos_idx + 1 :
+                ]
+
+            last_eos_idx = 0  # sequence always starts with a new sentence
+
+    return num_total, num_unks
+
+
+def file_tokens(file_name, start=0, end=None):
+    """
+      Devuelve (generador) los tokens de un fichero de texto procesado o, si se indica,
+      de su rango de bytes [start, end), que ha de empezar y terminar en un inicio de línea.
+    """
+    with open(file_name, "rb") as text:
+        text.seek(start)
+        while end is None or text.tell() < end:
+            line = text.readline()
+            if not line:
+                break
+            yield from line.decode("utf-8").split()
+
+
+def write_processed_dataset(input_files, output_file):
+    """
+      Función para el procesamiento de los datos de los ficheros, para su vectorización
+      de acuerdo al vocabulario de palabras y el de puntuaciones, generando los datos
+      de entrenamiento y validación para el modelo.
+      
+      Parámetros
+      ----------
+      input_files : list(str)
+        Contiene las rutas de los ficheros correspondientes al conjunto de ejemplos
+        procesado (entrenamiento o validación)
+      
+      output_file : str
+        Ruta base de los ficheros (ver ProcessedDatasetWriter) donde se guardarán las 
+        vectorizaciones de los datos procesados
+
+      Salida
+      ------
+        None
+        
+        Escribe los ficheros correspondientes.
+    """
+
+    # Se abre el fichero binario en el que se irán volcando las vectorizaciones de las
+    # frases según se vayan generando
+    writer = ProcessedDatasetWriter(output_file)
+
+    # Se leen los vocabularios de términos y puntuaciones
+    word_vocabulary = read_vocabulary(WORD_VOCAB_FILE)
+    punctuation_vocabulary = read_vocabulary(PUNCT_VOCAB_FILE)
+
+    # Se vectorizan los tokens de cada linea de cada archivo, como una única secuencia
+    tokens = (token for input_file in input_files for token in file_tokens(input_file))
+    num_total, num_unks = vectorize_tokens(tokens, writer, word_vocabulary, punctuation_vocabulary)
+
+    writer.close()
 
     # Se muestra el ratio de desconocidos entre los tokens leídos
     print("%.2f%% UNK-s in %s" % (num_unks / num_total * 100, output_file))
 
-    # Y se guardan los elementps como un archivo binario.
-    with open(output_file, "wb") as f:
-        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    # Si quieres ver el aspecto de las vectorizaciones, ábrelas con read_processed_dataset(output_file)
+
 
-    # Si quieres ver el aspecto de los ficheros (las vectorizaciones) descomenta las siguientes líneas
+# Vocabularios de cada proceso trabajador (modo por fragmentos), leídos una única vez por proceso
+_shard_vocabularies = None
 
-    with open(output_file + ".txt" , "w") as f:
-        for entry in data:
-          f.write(str(entry) + '\n')
+def _init_shard_worker():
+    global _shard_vocabularies
+    _shard_vocabularies = (read_vocabulary(WORD_VOCAB_FILE), read_vocabulary(PUNCT_VOCAB_FILE))
 
+def _write_shard(args):
+    input_file, start, end, shard_file = args
+    with ProcessedDatasetWriter(shard_file) as writer:
+        return vectorize_tokens(file_tokens(input_file, start, end), writer, *_shard_vocabularies)
 
-def create_dev_test_train_split_and_vocabulary(root_path, build_vocabulary, train_output, dev_output):
+def file_ranges(file_name, shard_bytes):
+    """
+      Divide un fichero en rangos de bytes [inicio, fin) de aproximadamente shard_bytes
+      bytes, ajustados a inicios de línea.
+    """
+    size = os.path.getsize(file_name)
+    ranges = []
+    start = 0
+    with open(file_name, "rb") as f:
+        while start < size:
+            f.seek(min(start + shard_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges or [(0, 0)]
+
+def write_processed_dataset_shards(input_files, output_file, workers=1, shard_bytes=SHARD_BYTES):
+    """
+      Versión por fragmentos (shards) de write_processed_dataset. Cada fichero de entrada, o
+      cada rango de shard_bytes bytes de un fichero (ajustado a inicios de línea), se vectoriza
+      de forma independiente en uno de los workers procesos, en su propio fragmento 
+      output_file.00000, output_file.00001, ... (ver processed_dataset_shards). Las subsecuencias
+      de cada fragmento siguen las mismas reglas que en write_processed_dataset (alineadas con los 
+      signos de final de frase), salvo que no se extienden de un fragmento al siguiente. Las 
+      estadísticas de desconocidos de los fragmentos se acumulan al final.
+
+      Parámetros
+      ----------
+      input_files : list(str)
+        Contiene las rutas de los ficheros correspondientes al conjunto de ejemplos
+        procesado (entrenamiento o validación)
+      
+      output_file : str
+        Ruta base de los fragmentos
+
+      workers : int, optional
+        Número de procesos. Por defecto 1
+
+      shard_bytes : int, optional
+        Tamaño máximo aproximado (en bytes de texto) de la entrada de cada fragmento. Por 
+        defecto SHARD_BYTES
+
+      Salida
+      ------
+        list(str)
+          Las rutas base de los fragmentos escritos, en orden.
+    """
+    tasks = [
+        (input_file, start, end)
+        for input_file in input_files
+        for start, end in file_ranges(input_file, shard_bytes)
+    ]
+    shard_files = ["%s.%05d" % (output_file, i) for i in range(len(tasks))]
+    tasks = [task + (shard_file,) for task, shard_file in zip(tasks, shard_files)]
+
+    with multiprocessing.Pool(workers, initializer=_init_shard_worker) as pool:
+        stats = pool.map(_write_shard, tasks, chunksize=1)
+
+    num_total = sum(total for total, _ in stats)
+    num_unks = sum(unks for _, unks in stats)
+
+    # Se muestra el ratio de desconocidos entre los tokens leídos
+    print("%.2f%% UNK-s in %s (%d shards)" % (num_unks / max(num_total, 1) * 100, output_file, len(shard_files)))
+
+    return shard_files
+
+
+def processed_dataset_shards(file_name):
+    """
+      Devuelve las rutas base de los fragmentos (file_name.00000, file_name.00001, ...) del
+      conjunto vectorizado file_name, en orden, o [file_name] si no está fragmentado.
+    """
+    shards = sorted(glob.glob(glob.escape(file_name) + ".[0-9][0-9][0-9][0-9][0-9]" + INDEX_EXT))
+    if not shards:
+        return [file_name]
+    return [shard[:-len(INDEX_EXT)] for shard in shards]
+
+
+def create_dev_test_train_split_and_vocabulary(root_path, build_vocabulary, train_output, dev_output, workers=1, shards=False):
     """
       Función para la creación de los ficheros vectorizados de entrenamiento y validación 
       
@@ -355,6 +667,15 @@ def create_dev_test_train_split_and_vocabulary(root_path, build_vocabulary, trai
       dev_output : str
           Nombre de los ficheros donde se escribirán las vectorizaciones de los datos de validación. 
 
+      workers : int, optional
+          Número de procesos para el recuento de las ocurrencias de los términos (ver 
+          build_word_counts) y, con shards, para la vectorización. Por defecto 1
+
+      shards : bool, optional
+          Indica si la vectorización se hace por fragmentos en paralelo (ver 
+          write_processed_dataset_shards), lo que descarta las subsecuencias incompletas del
+          final de cada fragmento, o en un único fichero (false). Por defecto false
+
       Salida
       ------
         None
@@ -366,16 +687,12 @@ def create_dev_test_train_split_and_vocabulary(root_path, build_vocabulary, trai
     # entrenamiento y validación, respectivamente. 
     train_txt_files = []
     dev_txt_files = []
-  
-    # Si es necesario construir el vocabulario se inicia el contador de ocurrencias
-    # de palabras vacío
-    if build_vocabulary:
-        word_counts = dict()
 
     # Se almacena cada archivo del directorio de datos, en la lista según la
     # extensión del fichero.
-    for root, _, filenames in os.walk(root_path):
-        for filename in fnmatch.filter(filenames, "*.txt"):
+    # (en orden, para que los fragmentos de una partición se procesen en el orden en que se escribieron)
+    for root, _, filenames in sorted(os.walk(root_path)):
+        for filename in sorted(fnmatch.filter(filenames, "*.txt")):
 
             path = os.path.join(root, filename)
             
@@ -384,17 +701,12 @@ def create_dev_test_train_split_and_vocabulary(root_path, build_vocabulary, trai
 
             elif filename.endswith(".train.txt"):
                 train_txt_files.append(path)
-
-                # Para los ficheros de entrenamiento se cuentan las ocurrencias
-                # de cada palbra para la construcción de lvocabulario (si procede)
-                if build_vocabulary:
-                    with codecs.open(path, "r", "utf-8") as text:
-                        for line in text:
-                            add_counts(word_counts, line)
     
-    # Si es necesario, se construye el vocabulario de acuerdo al contador de 
+    # Si es necesario, se cuentan las ocurrencias de cada palabra de los ficheros de 
+    # entrenamiento (en paralelo), se construye el vocabulario de acuerdo al contador 
     # de ocurrencias y se guarda en el fichero correspondiente
     if build_vocabulary:
+        word_counts = build_word_counts(train_txt_files, workers)
         vocabulary = create_vocabulary(word_counts)
         write_vocabulary(vocabulary, WORD_VOCAB_FILE)
         punctuation_vocabulary = iterable_to_dict(PUNCTUATION_VOCABULARY)
@@ -402,8 +714,13 @@ def create_dev_test_train_split_and_vocabulary(root_path, build_vocabulary, trai
 
     # Se procesan los distintos archivos de entrenamiento y validación y se 
     # escriben en los ficheros correspondientes.
-    write_processed_dataset(train_txt_files, train_output)
-    write_processed_dataset(dev_txt_files, dev_output)
+    # (si se pide, por fragmentos en paralelo: ver write_processed_dataset_shards)
+    if shards:
+        write_processed_dataset_shards(train_txt_files, train_output, workers)
+        write_processed_dataset_shards(dev_txt_files, dev_output, workers)
+    else:
+        write_processed_dataset(train_txt_files, train_output)
+        write_processed_dataset(dev_txt_files, dev_output)
 
 
 
@@ -419,6 +736,13 @@ if __name__ == "__main__":
       Parámetros
       ----------
       1. Ruta al directorio con los datos de las frases tokenizadas de entrenamiento y validación
+
+      Opciones
+      --------
+      --workers N : número de procesos para la construcción del vocabulario y, con --shards,
+                    para la vectorización (por defecto, el número de núcleos)
+      --shards : vectoriza por fragmentos en paralelo (ver write_processed_dataset_shards)
+                 en lugar de en un único fichero
     """
 
     if len(sys.argv) > 1:
@@ -434,6 +758,7 @@ if __name__ == "__main__":
         sys.exit("Data already exists")
 
     create_dev_test_train_split_and_vocabulary(
-        path, True, TRAIN_FILE, DEV_FILE
+        path, True, TRAIN_FILE, DEV_FILE, get_option(sys.argv, "--workers", os.cpu_count() or 1, int),
+        "--shards" in sys.argv
     )
 
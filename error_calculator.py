@@ -27,7 +27,9 @@ def compute_error(target_paths, predicted_paths, only_puncts=True):
 
     Salida
     ------
-    None
+    dict(str, float o dict(str, float))
+        Las métricas mostradas: precision, recall y f_score de cada signo (y "Overall"),
+        además del error ("Err") y el SER ("SER"), en porcentaje.
 
   """
 
@@ -142,6 +144,9 @@ def compute_error(target_paths, predicted_paths, only_puncts=True):
     overall_fp = 0.0
     overall_fn = 0.0
 
+    # Se guardan también las métricas para devolverlas
+    metrics = {}
+
     print("-"*46)
     print("{:<16} {:<9} {:<9} {:<9}".format('PUNCTUATION','PRECISION','RECALL','F-SCORE'))
 
@@ -161,6 +166,7 @@ def compute_error(target_paths, predicted_paths, only_puncts=True):
         recall = (true_positives.get(p,0.) / (true_positives.get(p,0.) + false_negatives.get(p, 0.))) if p in false_negatives or p in true_positives else nan
         f_score = (2. * precision * recall / (precision + recall)) if (precision + recall) > 0 else nan        
         print("{:<16} {:<9} {:<9} {:<9}".format(punctuation, round(precision*100,3), round(recall*100,3), round(f_score*100,3)))
+        metrics[punctuation] = {"precision": precision*100, "recall": recall*100, "f_score": f_score*100}
     print("-"*46)
     # Calculamos y mostramos las métricas generales
     pre = overall_tp/(overall_tp+overall_fp) if overall_fp else nan
@@ -170,6 +176,12 @@ def compute_error(target_paths, predicted_paths, only_puncts=True):
     print("Err: %s%%" % round((100.0 - float(total_correct) / float(counter-1) * 100.0), 2))
     print("SER: %s%%" % round((substitutions + deletions + insertions) / (correct + substitutions + deletions) * 100, 1))
 
+    metrics["Overall"] = {"precision": pre*100, "recall": rec*100, "f_score": f1*100}
+    metrics["Err"] = 100.0 - float(total_correct) / float(counter-1) * 100.0
+    metrics["SER"] = (substitutions + deletions + insertions) / (correct + substitutions + deletions) * 100
+
+    return metrics
+
 
 if __name__ == "__main__":
 
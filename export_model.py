@@ -0,0 +1,38 @@
+# coding: utf-8
+
+"""
+Exports a trained model (.pcl) as a self-contained SavedModel, with the vocabularies embedded,
+for serving processes that should not depend on ./punctdata.
+
+The exported model is used with:
+    punctuator = tf.saved_model.load(export_dir)
+    out = punctuator.punctuate(tokens, lengths)
+where tokens is a [time, batch] string matrix (lowercase words, columns padded at the end), lengths
+the real length of each column, and out["punctuations"] the [time-1, batch] punctuation tokens
+predicted after each word (out["probabilities"] holds their probabilities).
+"""
+
+from __future__ import division
+
+import models
+
+import sys
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        export_dir = sys.argv[2]
+    else:
+        sys.exit("Export directory argument missing")
+
+    print("Loading model parameters...")
+    net, _ = models.load(model_file, None)
+
+    print("Exporting model...")
+    models.export(net, export_dir)
+    print(f"SavedModel written to {export_dir}")
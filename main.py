@@ -2,9 +2,12 @@ from __future__ import division
 
 from time import time
 
+from preprocess import get_option
+
 import models, data
-import pickle
+import json
 import sys
+import os
 import os.path
 
 import tensorflow as tf
@@ -12,59 +15,238 @@ import numpy as np
 
 MAX_EPOCHS = 50
 MINIBATCH_SIZE = 32
+EVAL_BATCH_SIZE = 128 # no gradients nor optimizer state, so larger minibatches fit in memory
 CLIPPING_THRESHOLD = 2.0
 PATIENCE_EPOCHS = 1
+SHUFFLE_BUFFER_SIZE = 100000 # subsequence indices, not subsequences
+SHUFFLE_SEED = 1 # the training data of epoch e is shuffled with seed SHUFFLE_SEED + e
+CHECKPOINT_EVERY = 1000 # training iterations
+MAX_CHECKPOINTS = 3
 
 """
 Bi-directional RNN with attention
 For a sequence of N words, the model makes N punctuation decisions (no punctuation before the first word, but there's a decision after the last word or before </S>)
 """
 
-def get_minibatch(file_name, batch_size, shuffle, with_pauses=False):
+def make_dataset(file_names, batch_size, shuffle, drop_remainder=True, seed=None, num_input_pipelines=1, input_pipeline_id=0, skip_batches=0):
+    """
+    tf.data pipeline over one or several processed datasets (shards). Only the subsequence
+    indices go through the shuffle buffer; the minibatches are then read from the memory-mapped
+    files in parallel and prefetched, so input preparation overlaps with train_step.
+    Yields (X, Y) minibatches, already transposed because the model assumes the first axis is time.
+    With several input pipelines (distributed training), each one only reads its
+    1 / num_input_pipelines share of the subsequences. The first skip_batches minibatches are
+    skipped without reading them (to resume an epoch, with the same seed).
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    datasets = [data.read_processed_dataset(file_name) for file_name in file_names]
+    sizes = tf.constant([len(dataset) for dataset in datasets], dtype=tf.int64)
+
+    def read_batch(shards, indices):
+        return data.stack_subsequences([datasets[shard][i] for shard, i in zip(shards, indices)])
+
+    # (shard, index) pairs, interleaving the shards
+    pipeline = tf.data.Dataset.range(len(datasets)).interleave(
+        lambda shard: tf.data.Dataset.range(sizes[shard]).map(lambda i: (shard, i)),
+        cycle_length=len(datasets),
+        num_parallel_calls=tf.data.AUTOTUNE
+    )
 
-    with open(file_name, 'rb') as f:
-        dataset = pickle.load(f)
+    if num_input_pipelines > 1:
+        pipeline = pipeline.shard(num_input_pipelines, input_pipeline_id)
 
     if shuffle:
-        np.random.shuffle(dataset)
+        pipeline = pipeline.shuffle(min(SHUFFLE_BUFFER_SIZE, sum(len(dataset) for dataset in datasets)), seed=seed, reshuffle_each_iteration=True)
 
-    X_batch = []
-    Y_batch = []
+    pipeline = pipeline.batch(batch_size, drop_remainder=drop_remainder).skip(skip_batches)
+    pipeline = pipeline.map(
+        lambda shards, indices: tf.numpy_function(read_batch, [shards, indices], [tf.int32, tf.int32]),
+        num_parallel_calls=tf.data.AUTOTUNE
+    )
+    pipeline = pipeline.map(lambda X, Y: (tf.ensure_shape(X, [None, None]), tf.ensure_shape(Y, [None, None])))
 
-    if len(dataset) < batch_size:
-        lenwarning = (
-        f"WARNING: Not enough samples in {file_name}. "
-        f"Reduce mini-batch size to {len(dataset)} "
-        f"or use a dataset with at least {MINIBATCH_SIZE * data.MAX_SEQUENCE_LEN} words."
-        )
-        print(lenwarning)
+    return pipeline.prefetch(tf.data.AUTOTUNE)
 
-    for subsequence in dataset:
+def make_strategy(replicas=1, cluster=None, task=0):
+    """
+    tf.distribute strategy for data-parallel training: MultiWorkerMirroredStrategy across the
+    processes of cluster (comma-separated host:port list, one per process, this one being
+    number task), MirroredStrategy across replicas CPU logical devices, or the default single
+    device strategy. Must be called before TensorFlow initializes its devices.
+    """
+    if cluster is not None:
+        os.environ["TF_CONFIG"] = json.dumps({
+            "cluster": {"worker": cluster.split(",")},
+            "task": {"type": "worker", "index": task}
+        })
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    if replicas > 1:
+        cpu = tf.config.list_physical_devices("CPU")[0]
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * replicas)
+        return tf.distribute.MirroredStrategy([device.name for device in tf.config.list_logical_devices("CPU")])
+    return tf.distribute.get_strategy()
 
-        X_batch.append(subsequence[0])
-        Y_batch.append(subsequence[1])
+def make_distributed_dataset(file_names, batch_size, shuffle, seed=None, skip_steps=0):
+    """
+    make_dataset split among the input pipelines of the strategy, with minibatches of
+    batch_size subsequences per replica. Every replica gets the same number of minibatches
+    per epoch (the collective all-reduce of train_step needs all of them on every step).
+    The first skip_steps training steps are skipped.
+    """
+    num_subsequences = sum(len(data.read_processed_dataset(file_name)) for file_name in file_names)
+    steps = num_subsequences // (batch_size * strategy.num_replicas_in_sync)
 
-        if len(X_batch) == batch_size:
+    def dataset_fn(input_context):
+        replicas_per_pipeline = input_context.num_replicas_in_sync // input_context.num_input_pipelines
+        dataset = make_dataset(file_names, batch_size, shuffle, seed=seed,
+                               num_input_pipelines=input_context.num_input_pipelines,
+                               input_pipeline_id=input_context.input_pipeline_id,
+                               skip_batches=skip_steps * replicas_per_pipeline)
+        return dataset.take((steps - skip_steps) * replicas_per_pipeline)
 
-            # Transpose, because the model assumes the first axis is time
-            X = np.array(X_batch, dtype=np.int32).T
-            Y = np.array(Y_batch, dtype=np.int32).T
+    return strategy.distribute_datasets_from_function(dataset_fn)
 
-            yield X, Y
+def deduplicate(gradient):
+    """
+    Sums the rows of a sparse gradient (tf.IndexedSlices) that have the same index: the gradient
+    of the embeddings has a row per word of the minibatch, repeated words included. Dense
+    gradients are returned as they are.
+    """
+    if not isinstance(gradient, tf.IndexedSlices):
+        return gradient
+    indices, positions = tf.unique(gradient.indices)
+    values = tf.math.unsorted_segment_sum(gradient.values, positions, tf.shape(indices)[0])
+    return tf.IndexedSlices(values, indices, gradient.dense_shape)
 
-            X_batch = []
-            Y_batch = []
+class SparseAdagrad(tf.keras.optimizers.Adagrad):
+    """
+    Adagrad whose updates with sparse gradients (the embeddings) only read and write the rows of
+    the words of the minibatch. Keras reads the whole accumulator to take its square root, which
+    costs vocabulary size x n_hidden on every step. The rows of the gradient must be unique
+    (replica_train_step deduplicates them), so the update is the same as with the dense gradient.
+    """
 
-@tf.function
-def train_step(model, x, y):
+    def update_step(self, gradient, variable, learning_rate):
+        if not isinstance(gradient, tf.IndexedSlices):
+            return super(SparseAdagrad, self).update_step(gradient, variable, learning_rate)
+
+        if tf.distribute.get_strategy().num_replicas_in_sync > 1:
+            # The optimizer all-reduces the gradients of the replicas again, which concatenates the
+            # rows of all of them (the zero rows of the other replicas repeat the indices)
+            gradient = deduplicate(gradient)
+        lr = tf.cast(learning_rate, variable.dtype)
+        values = tf.cast(gradient.values, variable.dtype)
+        accumulator = self._accumulators[self._get_variable_index(variable)]
+
+        accumulated = tf.gather(accumulator.value, gradient.indices) + tf.square(values)
+        self.assign(accumulator, tf.IndexedSlices(accumulated, gradient.indices, gradient.dense_shape))
+        self.assign_sub(variable, tf.IndexedSlices(lr * values / tf.sqrt(accumulated + self.epsilon), gradient.indices, gradient.dense_shape))
+
+def replica_train_step(model, x, y, lengths=None):
+    # lengths is only needed when the minibatch packs padded sequences of different length
     with tf.GradientTape() as tape:
-        y_pred = model(x, training=True)
-        loss = models.cost(y_pred, y)
+        y_pred = model(x, lengths=lengths, training=True)
+        loss = models.cost(y_pred, y, lengths)
     gradients = tape.gradient(loss, model.params)
+    replica_context = tf.distribute.get_replica_context()
+    if replica_context.num_replicas_in_sync > 1:
+        # The gradient of the minibatch is the sum over the replicas (the cost is a sum), and it is
+        # clipped as a whole, as on a single device
+        gradients = replica_context.all_reduce(tf.distribute.ReduceOp.SUM, gradients)
+    # The embedding gradient stays sparse, and its norm is the one of the summed rows
+    gradients = [deduplicate(gradient) for gradient in gradients]
     gradients, _ = tf.clip_by_global_norm(gradients, clip_norm=CLIPPING_THRESHOLD)
+    if replica_context.num_replicas_in_sync > 1:
+        # The optimizer sums the gradients of the replicas again, so only the first one passes them
+        # on (the others pass zeros, which leaves the sum exact)
+        first = tf.cast(tf.equal(replica_context.replica_id_in_sync_group, 0), tf.float32)
+        gradients = [
+            tf.IndexedSlices(gradient.values * first, gradient.indices, gradient.dense_shape)
+            if isinstance(gradient, tf.IndexedSlices) else gradient * first
+            for gradient in gradients
+        ]
     optimizer.apply_gradients(zip(gradients, model.params))
     return loss
 
+@tf.function
+def train_step(model, x, y, lengths=None):
+    # x and y are distributed values when training with several replicas (see make_distributed_dataset)
+    losses = strategy.run(replica_train_step, args=(model, x, y, lengths))
+    return strategy.reduce(tf.distribute.ReduceOp.SUM, losses, axis=None)
+
+@tf.function(reduce_retracing=True)
+def eval_step(model, x, y):
+    # Summed cost and number of punctuation decisions of a minibatch. The last one of a dataset
+    # may be smaller, the retrace it causes is done once
+    return models.cost(model(x, training=False), y), tf.size(y, out_type=tf.int64)
+
+def evaluate(model, dataset):
+    """
+    Summed cost and number of punctuation decisions of a dataset. The totals are accumulated as
+    tensors, so that there's no host synchronization until the end of the pass.
+    """
+    total_neg_log_likelihood = tf.constant(0.0)
+    total_num_output_samples = tf.constant(0, tf.int64)
+    for X, Y in dataset:
+        neg_log_likelihood, num_output_samples = eval_step(model, X, Y)
+        total_neg_log_likelihood += neg_log_likelihood
+        total_num_output_samples += num_output_samples
+    return total_neg_log_likelihood.numpy(), total_num_output_samples.numpy()
+
+def num_labels(y):
+    # Number of punctuation decisions of a (distributed) minibatch, over all the workers
+    local_results = strategy.experimental_local_results(y)
+    return sum(np.prod(result.shape) for result in local_results) * strategy.num_replicas_in_sync // len(local_results)
+
+class TrainingCheckpoint(object):
+    """
+    Periodic checkpoints of a training run, to resume it after the job is killed. The parameters
+    and the optimizer state (Adagrad accumulators and iteration count) go in a tf.train.Checkpoint,
+    and the progress of the run (epoch, iteration within the epoch, running training cost,
+    validation history, NumPy RNG state) in a JSON file next to it. The position in the training
+    data isn't saved: the epoch is shuffled again with the same seed and the minibatches already
+    seen are skipped (see make_dataset).
+    """
+
+    def __init__(self, directory, model, optimizer, max_to_keep=MAX_CHECKPOINTS):
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=optimizer)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, directory, max_to_keep)
+
+    def save(self, number, progress):
+        # The JSON file is written first, so that the latest checkpoint always has one
+        path = os.path.join(self.manager.directory, f"ckpt-{number}")
+        os.makedirs(self.manager.directory, exist_ok=True)
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(progress, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        self.manager.save(checkpoint_number=number)
+        for file_name in os.listdir(self.manager.directory):
+            checkpoint = os.path.join(self.manager.directory, file_name)[:-len(".json")]
+            if file_name.endswith(".json") and checkpoint not in self.manager.checkpoints:
+                os.remove(checkpoint + ".json")
+
+    def restore(self):
+        # Progress of the latest checkpoint (the parameters and optimizer state are restored in
+        # place), or None if there's none
+        path = self.manager.latest_checkpoint
+        if path is None:
+            return None
+        self.checkpoint.restore(path).assert_consumed()
+        with open(path + ".json") as f:
+            return json.load(f)
+
+def rng_state_to_json(state):
+    name, keys, position, has_gauss, cached_gaussian = state
+    return [name, keys.tolist(), position, has_gauss, cached_gaussian]
+
+def rng_state_from_json(state):
+    name, keys, position, has_gauss, cached_gaussian = state
+    return name, np.array(keys, dtype=np.uint32), position, has_gauss, cached_gaussian
+
+strategy = tf.distribute.get_strategy()
+
 if __name__ == "__main__":
     
     starting_time = time()
@@ -85,6 +267,21 @@ if __name__ == "__main__":
 
     model_file_name = "Model_%s_h%d_lr%s.pcl" % (model_name, num_hidden, learning_rate)
 
+    # Data-parallel training: --replicas N splits every minibatch among N CPU replicas in this
+    # process, --cluster host:port,host:port,... --task i runs this process as worker i of a
+    # multi-worker cluster (start one process per address). MINIBATCH_SIZE is per replica
+    replicas = get_option(sys.argv, "--replicas", 1, int)
+    cluster = get_option(sys.argv, "--cluster")
+    task = get_option(sys.argv, "--task", 0, int)
+    strategy = make_strategy(replicas, cluster, task)
+    is_chief = cluster is None or task == 0
+
+    # Checkpoints every --checkpoint-every iterations and at the end of every epoch, in
+    # --checkpoint-dir. --resume continues from the latest one
+    checkpoint_dir = get_option(sys.argv, "--checkpoint-dir", os.path.splitext(model_file_name)[0] + ".checkpoints")
+    checkpoint_every = get_option(sys.argv, "--checkpoint-every", CHECKPOINT_EVERY, int)
+    resume = "--resume" in sys.argv
+
     print(num_hidden, learning_rate, model_file_name)
 
     rng = np.random
@@ -95,39 +292,94 @@ if __name__ == "__main__":
     x_len = vocab_len if vocab_len < data.MAX_WORD_VOCABULARY_SIZE else data.MAX_WORD_VOCABULARY_SIZE + data.MIN_WORD_COUNT_IN_VOCAB
     x = np.ones((x_len, MINIBATCH_SIZE)).astype(int)
     # Initialize the weights of the model without any real data, comparable to placeholders in earlier Tensorflow version
-    net = models.GRU(rng, x, num_hidden)
-    optimizer = tf.keras.optimizers.Adagrad(learning_rate=learning_rate, initial_accumulator_value=1e-6)
+    with strategy.scope():
+        net = models.GRU(rng, x, num_hidden)
+        optimizer = SparseAdagrad(learning_rate=learning_rate, initial_accumulator_value=1e-6)
+        optimizer.build(net.params)
+
+    # --bf16: mixed precision, the parameters and the optimizer state stay in float32
+    if "--bf16" in sys.argv:
+        print("Using mixed precision (bfloat16)")
+        models.set_compute_dtype(net, models.BFLOAT16)
 
     starting_epoch = 0
+    starting_iteration = 0
+    step = 0
     best_ppl = np.inf
     validation_ppl_history = []
+    training_totals = (0, 0)
+
+    checkpoint = TrainingCheckpoint(checkpoint_dir, net, optimizer)
+    progress = checkpoint.restore() if resume else None
+    if progress is not None:
+        starting_epoch = progress["epoch"]
+        starting_iteration = progress["iteration"]
+        step = progress["step"]
+        best_ppl = progress["best_ppl"]
+        validation_ppl_history = progress["validation_ppl_history"]
+        training_totals = tuple(progress["training_totals"])
+        rng.set_state(rng_state_from_json(progress["random_state"]))
+        print(f"Resuming from {checkpoint.manager.latest_checkpoint}: epoch {starting_epoch}, iteration {starting_iteration}")
+    elif resume:
+        print(f"No checkpoint in {checkpoint_dir}, starting from scratch")
+
+    def save_checkpoint(epoch, iteration, training_totals):
+        # Every worker holds the same parameters and optimizer state, only the first one saves them
+        if is_chief:
+            checkpoint.save(step, {
+                "epoch": epoch, "iteration": iteration, "step": step,
+                "best_ppl": float(best_ppl), "validation_ppl_history": [float(ppl) for ppl in validation_ppl_history],
+                "training_totals": [float(total) for total in training_totals],
+                "random_state": rng_state_to_json(rng.get_state())
+            })
 
     print(f"Total number of trainable parameters: {sum(np.prod([dim for dim in param.get_shape()]) for param in net.params)}")
 
+    # The processed datasets may be written in shards (see data.write_processed_dataset_shards)
+    train_files = data.processed_dataset_shards(data.TRAIN_FILE)
+    # The last partial minibatch of every epoch is dropped, so a smaller training set would give no iterations
+    num_train_subsequences = sum(len(data.read_processed_dataset(file_name)) for file_name in train_files)
+    global_batch_size = MINIBATCH_SIZE * strategy.num_replicas_in_sync
+    if num_train_subsequences < global_batch_size:
+        sys.exit(
+            f"Not enough samples in {', '.join(train_files)}. "
+            f"Reduce mini-batch size to {num_train_subsequences // strategy.num_replicas_in_sync} "
+            f"or use a dataset with at least {global_batch_size * data.MAX_SEQUENCE_LEN} words."
+        )
+    # The whole validation set, including the last (partial) minibatch
+    dev_dataset = make_dataset(data.processed_dataset_shards(data.DEV_FILE), EVAL_BATCH_SIZE, shuffle=False, drop_remainder=False)
+    if strategy.num_replicas_in_sync > 1:
+        print(f"Training on {strategy.num_replicas_in_sync} replicas")
+
     print("Training...")
     for epoch in range(starting_epoch, MAX_EPOCHS):
+        # Seeded per epoch, so that a resumed epoch sees the same minibatches
+        iteration = starting_iteration if epoch == starting_epoch else 0
+        if strategy.num_replicas_in_sync > 1:
+            train_dataset = make_distributed_dataset(train_files, MINIBATCH_SIZE, shuffle=True, seed=SHUFFLE_SEED + epoch, skip_steps=iteration)
+        else:
+            train_dataset = make_dataset(train_files, MINIBATCH_SIZE, shuffle=True, seed=SHUFFLE_SEED + epoch, skip_batches=iteration)
+
         t0 = time()
-        total_neg_log_likelihood = 0
-        total_num_output_samples = 0
-        iteration = 0 
-        for X, Y in get_minibatch(data.TRAIN_FILE, MINIBATCH_SIZE, shuffle=True):
+        total_neg_log_likelihood, total_num_output_samples = training_totals if epoch == starting_epoch else (0, 0)
+        speed_samples = 0
+        for X, Y in train_dataset:
             loss = train_step(net, X, Y)
             total_neg_log_likelihood += loss
-            total_num_output_samples += np.prod(Y.shape)
+            total_num_output_samples += num_labels(Y)
+            speed_samples += num_labels(Y)
             iteration += 1
+            step += 1
             if iteration % 100 == 0:
-                sys.stdout.write("PPL: %.4f; Speed: %.2f sps\n" % (np.exp(total_neg_log_likelihood / total_num_output_samples), total_num_output_samples / max(time() - t0, 1e-100)))
+                sys.stdout.write("PPL: %.4f; Speed: %.2f sps\n" % (np.exp(total_neg_log_likelihood / total_num_output_samples), speed_samples / max(time() - t0, 1e-100)))
                 sys.stdout.flush()
+            if step % checkpoint_every == 0:
+                save_checkpoint(epoch, iteration, (total_neg_log_likelihood, total_num_output_samples))
         print(f"Total number of training labels: {total_num_output_samples}")
 
-        total_neg_log_likelihood = 0
-        total_num_output_samples = 0
-        for X, Y in get_minibatch(data.DEV_FILE, MINIBATCH_SIZE, shuffle=False):
-            total_neg_log_likelihood += models.cost(net(X, training=True), Y)
-            print(f"Total neg log likelihood in dev iteration {iteration}, epoch {epoch}: {total_neg_log_likelihood}")
-            total_num_output_samples += np.prod(Y.shape)
-            print(f"Total num output samples in dev iteration {iteration}, epoch {epoch}: {total_num_output_samples}")
-        print(f"Total number of validation labels: {total_num_output_samples}")
+        t0 = time()
+        total_neg_log_likelihood, total_num_output_samples = evaluate(net, dev_dataset)
+        print(f"Total number of validation labels: {total_num_output_samples} ({time() - t0:.2f} s)")
 
         ppl = np.exp(total_neg_log_likelihood / total_num_output_samples)
         validation_ppl_history.append(ppl)
@@ -136,9 +388,13 @@ if __name__ == "__main__":
 
         if ppl <= best_ppl:
             best_ppl = ppl
-            models.save(net, model_file_name, learning_rate=learning_rate, validation_ppl_history=validation_ppl_history, best_validation_ppl=best_ppl, epoch=epoch, random_state=rng.get_state())
+            # Every worker holds the same parameters, only the first one writes the model
+            if is_chief:
+                models.save(net, model_file_name, learning_rate=learning_rate, validation_ppl_history=validation_ppl_history, best_validation_ppl=best_ppl, epoch=epoch, random_state=rng.get_state())
         elif best_ppl not in validation_ppl_history[-PATIENCE_EPOCHS:]:
             print("Finished!")
             print(f"Best validation perplexity was {best_ppl}")
             print(f"Total time: {time() - starting_time}")
             break
+
+        save_checkpoint(epoch + 1, 0, (0, 0))
@@ -6,6 +6,22 @@ from tensorflow.keras import layers
 import numpy as np 
 import data
 
+from types import SimpleNamespace
+
+# Encoder backends: FUSED computes the input projections of all the timesteps with a single
+# matmul before the recurrence, so only the recurrent matmuls are left inside tf.scan.
+# SCAN computes them timestep by timestep. Both use the same parameters.
+FUSED = "fused"
+SCAN = "scan"
+
+# Post-training quantization modes (see quantize)
+INT8 = "int8"
+FLOAT16 = "float16"
+
+# Mixed precision (see set_compute_dtype): the parameters are kept in float32 and the
+# recurrences are computed in bfloat16, except for the softmaxes and the cost
+BFLOAT16 = "bfloat16"
+
 def _get_shape(i, o, keepdims):
     if (i == 1 or o == 1) and not keepdims:
         return [max(i,o),]
@@ -23,7 +39,7 @@ def weights_Glorot(i, o, name, rng, is_logistic_sigmoid=False, keepdims=False):
         d *= 4.
     return tf.Variable(tf.random.uniform(_get_shape(i, o, keepdims), -d, d))
 
-def load(file_path, x, p=None):
+def load(file_path, x, p=None, backend=FUSED):
     import models
     import pickle
     import numpy as np
@@ -39,26 +55,122 @@ def load(file_path, x, p=None):
     net = Model(
         rng=rng,
         x=x,
-        n_hidden=state["n_hidden"]
+        n_hidden=state["n_hidden"],
+        backend=backend
         )
 
     for net_param, state_param in zip(net.params, state["params"]):
         net_param.assign(state_param)
 
+    warm_up(net)
+
     return net, (state["learning_rate"], state["validation_ppl_history"], state["epoch"], rng)
 
+class QuantizedWeight(tf.Module):
+    """
+    Weight-only int8 quantization of a matrix: symmetric, with one float32 scale per slice
+    along axis (per row of the embeddings, per output column of the other matrices).
+    """
+
+    def __init__(self, weight, axis):
+        super(QuantizedWeight, self).__init__()
+        w = weight.numpy()
+        scale = np.abs(w).max(axis=1 - axis, keepdims=True) / 127.
+        scale[scale == 0] = 1.
+        self.values = tf.Variable(np.round(w / scale).astype(np.int8), trainable=False)
+        self.scale = tf.Variable(scale.astype(np.float32), trainable=False)
+
+    def dequantize(self):
+        return tf.cast(self.values, tf.float32) * self.scale
+
+    def lookup(self, ids):
+        # Dequantizes only the rows that are looked up
+        return tf.cast(tf.gather(self.values, ids), tf.float32) * tf.gather(self.scale, ids)
+
+def read_weight(weight, dtype=tf.float32):
+    # Value of a parameter ready for the computations, in the compute dtype
+    if isinstance(weight, QuantizedWeight):
+        weight = weight.dequantize()
+    if weight.dtype != dtype:
+        return tf.cast(weight, dtype)
+    return weight
+
+def read_weights(layer, dtype=tf.float32):
+    """
+    The parameters of a layer ready for the computations, read once per call and outside the
+    recurrences. Plain variables of the compute dtype are used as they are.
+    """
+    return SimpleNamespace(**{name: read_weight(getattr(layer, name), dtype) for name in layer.WEIGHTS})
+
+def embedding_lookup(We, ids, dtype=tf.float32):
+    # Only the rows that are looked up are cast, so the gradient of We stays sparse
+    if isinstance(We, QuantizedWeight):
+        embeddings = We.lookup(ids)
+    else:
+        embeddings = tf.nn.embedding_lookup(We, ids)
+    if embeddings.dtype != dtype:
+        return tf.cast(embeddings, dtype)
+    return embeddings
+
+def set_compute_dtype(model, dtype):
+    """
+    Computes the model in dtype (BFLOAT16 for mixed precision, or float32). The parameters are
+    still stored, updated and saved in float32 and the attention weights, the outputs
+    (logits) and so the cost are computed in float32. bfloat16 has the range of float32, so the
+    training cost doesn't need loss scaling.
+    """
+    # Keras mixed precision policy: float32 variables, computations in dtype
+    dtype = tf.as_dtype(dtype)
+    model.dtype_policy = "float32" if dtype == tf.float32 else "mixed_" + dtype.name
+    model.reset_inference()
+    warm_up(model)
+
+def quantize(model, mode):
+    """
+    Post-training weight-only quantization of a model for inference: the embeddings and the
+    weight matrices are stored as int8 (INT8, dequantized on the fly) or float16 (FLOAT16);
+    the computations are still done in float32. The model can't be trained or saved afterwards.
+    """
+    replaced = {}
+    for layer in [model, model.GRU_f, model.GRU_b, model.GRU]:
+        for name in layer.QUANTIZABLE:
+            weight = getattr(layer, name)
+            if mode == INT8:
+                # rows of the embeddings, output columns of the other matrices
+                quantized = QuantizedWeight(weight, axis=0 if name == "We" else 1)
+            elif mode == FLOAT16:
+                quantized = tf.Variable(tf.cast(weight, tf.float16), trainable=False)
+            else:
+                raise ValueError("Unknown quantization mode: %s" % mode)
+            setattr(layer, name, quantized)
+            replaced[id(weight)] = quantized
+
+    for layer in [model, model.GRU_f, model.GRU_b, model.GRU]:
+        layer.params = [replaced.get(id(param), param) for param in layer.params]
+
+    model.reset_inference()
+    warm_up(model)
+
+def weights_size(model):
+    # Bytes taken by the parameters of the model
+    size = 0
+    for param in model.params:
+        for variable in ([param.values, param.scale] if isinstance(param, QuantizedWeight) else [param]):
+            size += variable.shape.num_elements() * variable.dtype.size
+    return size
+
 class GRUCell(layers.Layer):
 
-    def __init__(self, rng, n_in, n_out, minibatch_size):
+    WEIGHTS = ["W_x", "W_h", "b", "W_x_h", "W_h_h", "b_h"]
+    QUANTIZABLE = ["W_x", "W_h", "W_x_h", "W_h_h"]
+
+    def __init__(self, rng, n_in, n_out):
         super(GRUCell, self).__init__()
         # Notation from: An Empirical Exploration of Recurrent Network Architectures
 
         self.n_in = n_in
         self.n_out = n_out
 
-        # Initial hidden state
-        self.h0 = tf.zeros([minibatch_size, n_out])
-
         # Gate parameters:
         self.W_x = weights_Glorot(n_in, n_out*2, 'W_x', rng)
         self.W_h = weights_Glorot(n_out, n_out*2, 'W_h', rng)
@@ -69,28 +181,47 @@ class GRUCell(layers.Layer):
         self.b_h = tf.Variable(tf.zeros([1, n_out]))
 
         self.params = [self.W_x, self.W_h, self.b, self.W_x_h, self.W_h_h, self.b_h]
-    
-    # inputs = x_t, h_tm1
-    def call(self, inputs):
 
-        rz = tf.nn.sigmoid(tf.matmul(inputs[0], self.W_x) + tf.matmul(inputs[1], self.W_h) + self.b)
+    def initial_state(self, batch_size, dtype=tf.float32):
+        # Initial hidden state, sized after the minibatch actually fed to the model
+        return tf.zeros([batch_size, self.n_out], dtype)
+    
+    def project_inputs(self, x, w):
+        # Input part of the gates and of the candidate state, [..., n_out*3]. x can hold any
+        # number of timesteps, so the whole sequence is projected with a single matmul.
+        # w holds the parameters of the cell (see read_weights)
+        W = tf.concat([w.W_x, w.W_x_h], axis=1)
+        b = tf.concat([w.b, w.b_h], axis=1)
+        return tf.tensordot(x, W, 1) + b
+
+    def step(self, x_t, h_tm1, w):
+        # x_t is the projected input of the timestep (see project_inputs)
+        rz = tf.nn.sigmoid(x_t[:, :self.n_out*2] + tf.matmul(h_tm1, w.W_h))
         r = _slice(rz, self.n_out, 0)
         z = _slice(rz, self.n_out, 1)
 
-        h = tf.nn.tanh(tf.matmul(inputs[0], self.W_x_h) + tf.matmul(inputs[1] * r, self.W_h_h) + self.b_h)
+        h = tf.nn.tanh(x_t[:, self.n_out*2:] + tf.matmul(h_tm1 * r, w.W_h_h))
 
-        h_t = z * inputs[1] + (1. - z) * h
+        h_t = z * h_tm1 + (1. - z) * h
 
         return h_t
 
+    # inputs = x_t, h_tm1
+    def call(self, inputs):
+        w = read_weights(self)
+        return self.step(self.project_inputs(inputs[0], w), inputs[1], w)
+
 class GRU(tf.keras.Model):
 
-    def __init__(self, rng, x, n_hidden):
-        super(GRU, self).__init__()
+    WEIGHTS = ["Wy", "by", "Wa_h", "Wa_c", "ba", "Wa_y", "Wf_h", "Wf_c", "Wf_f", "bf"]
+    QUANTIZABLE = ["We", "Wy", "Wa_h", "Wa_c", "Wf_h", "Wf_c", "Wf_f"]
 
-        self.minibatch_size = tf.shape(x)[1]
+    def __init__(self, rng, x, n_hidden, backend=FUSED):
+        super(GRU, self).__init__()
 
+        # x is not needed anymore: the minibatch size is taken from the inputs on every call
         self.n_hidden = n_hidden
+        self.backend = backend
         self.x_vocabulary = data.read_vocabulary(data.WORD_VOCAB_FILE)
         self.y_vocabulary = data.read_vocabulary(data.PUNCT_VOCAB_FILE)
 
@@ -99,11 +230,11 @@ class GRU(tf.keras.Model):
 
         # input model
         self.We = weights_Glorot(self.x_vocabulary_size, n_hidden, 'We', rng) # Share embeddings between forward and backward model
-        self.GRU_f = GRUCell(rng=rng, n_in=n_hidden, n_out=n_hidden, minibatch_size=self.minibatch_size)
-        self.GRU_b = GRUCell(rng=rng, n_in=n_hidden, n_out=n_hidden, minibatch_size=self.minibatch_size)
+        self.GRU_f = GRUCell(rng=rng, n_in=n_hidden, n_out=n_hidden)
+        self.GRU_b = GRUCell(rng=rng, n_in=n_hidden, n_out=n_hidden)
 
         # output model
-        self.GRU = GRUCell(rng=rng, n_in=n_hidden*2, n_out=n_hidden, minibatch_size=self.minibatch_size)
+        self.GRU = GRUCell(rng=rng, n_in=n_hidden*2, n_out=n_hidden)
         self.Wy = tf.Variable(tf.zeros([n_hidden, self.y_vocabulary_size]))
         self.by = tf.Variable(tf.zeros([1, self.y_vocabulary_size]))
 
@@ -127,72 +258,177 @@ class GRU(tf.keras.Model):
 
         self.params += self.GRU.params + self.GRU_f.params + self.GRU_b.params
         print([x.shape for x in self.params])
+
+        self.reset_inference()
+
+    def reset_inference(self):
+        # Inference function, traced once and reused for every window length and minibatch size.
+        # It has to be reset if the parameters are replaced (assigning them new values is fine).
+        self.infer = tf.function(self._infer, input_signature=[
+            tf.TensorSpec([None, None], tf.int32), # inputs
+            tf.TensorSpec([None], tf.int32) # lengths
+        ])
+
+    def _infer(self, inputs, lengths):
+        return tf.nn.softmax(self(inputs, lengths=lengths))
         
-    def call(self, inputs, training=None):
+    def call(self, inputs, lengths=None, training=None):
+        # inputs is a [time, batch] matrix of word ids. Columns shorter than the longest one
+        # are padded at the end and lengths holds the real length of each column.
+
+        dtype = tf.as_dtype(self.compute_dtype) # Keras dtype policy, see set_compute_dtype
+        batch_size = tf.shape(inputs)[1]
+        mask = sequence_mask(lengths, tf.shape(inputs)[0], batch_size)
+        recurrence_mask = tf.cast(mask, dtype)
+
+        w = read_weights(self, dtype)
+        w_f = read_weights(self.GRU_f, dtype)
+        w_b = read_weights(self.GRU_b, dtype)
+        w_o = read_weights(self.GRU, dtype)
 
         # bi-directional recurrence
+        embeddings = embedding_lookup(self.We, inputs, dtype)
+
         def input_recurrence(initializer, elems):
-            x_f_t, x_b_t = elems
+            x_f_t, x_b_t, m_f_t, m_b_t = elems
             h_f_tm1, h_b_tm1 = initializer
 
-            h_f_t = self.GRU_f(inputs=(tf.nn.embedding_lookup(self.We, x_f_t), h_f_tm1))
-            h_b_t = self.GRU_b(inputs=(tf.nn.embedding_lookup(self.We, x_b_t), h_b_tm1))
+            h_f_t = self._step(self.GRU_f, x_f_t, h_f_tm1, w_f)
+            h_b_t = self._step(self.GRU_b, x_b_t, h_b_tm1, w_b)
+
+            # padded positions keep the previous state, so the backward model starts
+            # from its initial state at the last real word of each column
+            h_f_t = m_f_t * h_f_t + (1. - m_f_t) * h_f_tm1
+            h_b_t = m_b_t * h_b_t + (1. - m_b_t) * h_b_tm1
             return [h_f_t, h_b_t]
 
         [h_f_t, h_b_t] = tf.scan(
             fn=input_recurrence,
-            elems=[inputs, inputs[::-1]], # forward and backward sequences
-            initializer=[self.GRU_f.h0, self.GRU_b.h0]
+            elems=[self._inputs(self.GRU_f, embeddings, w_f), self._inputs(self.GRU_b, embeddings[::-1], w_b), recurrence_mask[:,:,None], recurrence_mask[::-1][:,:,None]], # forward and backward sequences
+            initializer=[self.GRU_f.initial_state(batch_size, dtype), self.GRU_b.initial_state(batch_size, dtype)]
         )
 
         # 0-axis is time steps, 1-axis is batch size and 2-axis is hidden layer size
         context = tf.concat([h_f_t, h_b_t[::-1]], axis=2)
-        #projected_context = tf.matmul(context, self.Wa_c) + self.ba for each tensor slice
-        projected_context = tf.matmul(context, tf.tile(tf.expand_dims(self.Wa_c, 0), tf.stack([tf.shape(context)[0], 1, 1]))) + self.ba
+
+        # The attention model works batch-major ([batch, time, 2*hidden]), so that the context
+        # is transposed and projected only once and not on every step of the output recurrence
+        attended_context = tf.transpose(context, [1, 0, 2])
+        projected_context = tf.tensordot(attended_context, w.Wa_c, 1) + w.ba
+        attention_bias = attention_mask_bias(tf.transpose(mask))
 
         def output_recurrence(initializer, elems):
             x_t = elems
             h_tm1, _, _ = initializer
 
             # Attention model
-            h_a = tf.nn.tanh(projected_context + tf.matmul(h_tm1, self.Wa_h))
-
-            #alphas = tf.exp(tf.matmul(h_a, self.Wa_y))
-            #alphas = tf.reshape(alphas, [tf.shape(alphas)[0], tf.shape(alphas)[1]]) # drop 2-axis (sized 1) is replaced by:
-            #sess.run(tf.reshape(tf.matmul(tf.reshape(x, [-1, tf.shape(x)[-1]]), tf.expand_dims(z,-1)), tf.shape(x)[:2]))
-            alphas = tf.exp(tf.reshape(tf.matmul(tf.reshape(h_a, [-1, tf.shape(h_a)[-1]]), tf.expand_dims(self.Wa_y, -1)), tf.shape(h_a)[:2]))
-            alphas = alphas / tf.reduce_sum(alphas, axis=0, keepdims=True)
-            weighted_context = tf.reduce_sum(context * alphas[:,:,None], axis=0)
+            weighted_context = attention(attended_context, projected_context, attention_bias, tf.matmul(h_tm1, w.Wa_h), w.Wa_y)
             
-            h_t = self.GRU(inputs=(x_t, h_tm1))
+            h_t = self._step(self.GRU, x_t, h_tm1, w_o)
 
             # Late fusion
-            lfc = tf.matmul(weighted_context, self.Wf_c) # late fused context
-            fw = tf.nn.sigmoid(tf.matmul(lfc, self.Wf_f) + tf.matmul(h_t, self.Wf_h) + self.bf) # fusion weights
+            lfc = tf.matmul(weighted_context, w.Wf_c) # late fused context
+            fw = tf.nn.sigmoid(tf.matmul(lfc, w.Wf_f) + tf.matmul(h_t, w.Wf_h) + w.bf) # fusion weights
             hf_t = lfc * fw + h_t # weighted fused context + hidden state
 
-            z = tf.matmul(hf_t, self.Wy) + self.by
+            z = tf.cast(tf.matmul(hf_t, w.Wy) + w.by, tf.float32) # the softmax and the cost are computed in float32
             y_t = z#tf.nn.softmax(z)
 
             return [h_t, hf_t, y_t]
 
         [_, self.last_hidden_states, self.y] = tf.scan(
             fn=output_recurrence,
-            elems=context[1:], # ignore the 1st word in context, because there's no punctuation before that
-            initializer=[self.GRU.h0, self.GRU.h0, tf.zeros([self.minibatch_size, self.y_vocabulary_size])]
+            elems=self._inputs(self.GRU, context[1:], w_o), # ignore the 1st word in context, because there's no punctuation before that
+            initializer=[self.GRU.initial_state(batch_size, dtype), self.GRU.initial_state(batch_size, dtype), tf.zeros([batch_size, self.y_vocabulary_size])]
         )
         
         return self.y
 
-def cost(y_pred, y_true):
-    return tf.reduce_sum(tf.nn.sparse_softmax_cross_entropy_with_logits(logits=y_pred, labels=y_true))
+    def _inputs(self, cell, x, w):
+        # Sequence fed to tf.scan for a cell: its input projections for the fused backend, x itself otherwise
+        return cell.project_inputs(x, w) if self.backend == FUSED else x
+
+    def _step(self, cell, x_t, h_tm1, w):
+        if self.backend == FUSED:
+            return cell.step(x_t, h_tm1, w)
+        return cell.step(cell.project_inputs(x_t, w), h_tm1, w)
+
+def warm_up(model):
+    # Traces the inference function, so the first real request doesn't pay for it
+    model.infer(np.ones((2, 1), dtype=np.int32), np.array([2], dtype=np.int32))
+
+def attention_mask_bias(mask):
+    """Additive bias for the attention scores that leaves the padded positions (mask 0) out of the softmax"""
+    return (mask - 1.) * 1e9
+
+def attention(context, projected_context, bias, projected_h_tm1, Wa_y):
+    """
+    Attention over the batch-major context [batch, time, 2*hidden] for one step of the output
+    recurrence, given its projection by Wa_c (+ ba) and the projection of the previous output
+    state by Wa_h. Returns the weighted context [batch, 2*hidden].
+    """
+    h_a = tf.nn.tanh(projected_context + projected_h_tm1[:, None, :])
+    # The scores and the softmax are computed in float32 (bias is float32), whatever the compute dtype
+    alphas = tf.nn.softmax(tf.cast(tf.tensordot(h_a, Wa_y, 1), tf.float32) + bias, axis=1)
+    return tf.matmul(tf.cast(alphas, context.dtype)[:, None, :], context)[:, 0, :]
+
+def sequence_mask(lengths, max_len, batch_size):
+    """[time, batch] float mask with ones over the real (not padded) positions of each column"""
+    if lengths is None:
+        return tf.ones([max_len, batch_size])
+    return tf.transpose(tf.sequence_mask(lengths, max_len, dtype=tf.float32))
+
+def cost(y_pred, y_true, lengths=None):
+    neg_log_likelihood = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=y_pred, labels=y_true)
+    if lengths is not None:
+        # A column of length n has n - 1 punctuation decisions, the rest are padding
+        neg_log_likelihood *= sequence_mask(lengths - 1, tf.shape(y_true)[0], tf.shape(y_true)[1])
+    return tf.reduce_sum(neg_log_likelihood)
+
+class PunctuationModule(tf.Module):
+    """
+    Self-contained serving wrapper of a model: the vocabularies are embedded as lookup tables,
+    so the exported SavedModel takes raw token strings and doesn't need ./punctdata.
+    """
+
+    def __init__(self, model):
+        super(PunctuationModule, self).__init__()
+        # Only the variables of the model are tracked (the Keras model itself can't be exported as is)
+        self.params = list(model.params)
+
+        words = sorted(model.x_vocabulary, key=model.x_vocabulary.get)
+        self.word_table = tf.lookup.StaticHashTable(
+            tf.lookup.KeyValueTensorInitializer(tf.constant(words), tf.range(len(words), dtype=tf.int32)),
+            default_value=model.x_vocabulary[data.UNK]
+        )
+        num_id = model.x_vocabulary["<NUM>"]
+        punctuations = tf.constant(sorted(model.y_vocabulary, key=model.y_vocabulary.get))
+
+        def punctuate(tokens, lengths):
+            ids = self.word_table.lookup(tokens)
+            ids = tf.where(tf.strings.regex_full_match(tokens, r"\d+"), num_id, ids)
+            probabilities = model.infer(ids, lengths)
+            # punctuation decided after each word but the last one, [time-1, batch]
+            return {
+                "punctuations": tf.gather(punctuations, tf.argmax(probabilities, axis=-1)),
+                "probabilities": probabilities
+            }
+
+        self.punctuate = tf.function(punctuate, input_signature=[
+            tf.TensorSpec([None, None], tf.string, name="tokens"), # [time, batch], padded at the end of each column
+            tf.TensorSpec([None], tf.int32, name="lengths")
+        ])
+
+def export(model, export_dir):
+    module = PunctuationModule(model)
+    tf.saved_model.save(module, export_dir, signatures={"serving_default": module.punctuate})
 
 def save(model, file_path, learning_rate=None, validation_ppl_history=None, best_validation_ppl=None, epoch=None, random_state=None):
     import pickle
     state = {
         "type":                     model.__class__.__name__,
         "n_hidden":                 model.n_hidden,
-        "params":                   [p for p in model.params],
+        "params":                   [p.numpy() for p in model.params], # distributed (mirrored) variables can't be pickled
         "learning_rate":            learning_rate,
         "validation_ppl_history":   validation_ppl_history,
         "epoch":                    epoch,
@@ -70,7 +70,7 @@ def punctuate(word_vocabulary, punctuation_vocabulary, reverse_punctuation_vocab
         i += step
 
 def predict(x, model):
-    return tf.nn.softmax(net(x))
+    return model.infer(x, np.full(x.shape[1], x.shape[0], dtype=np.int32))
 
 if __name__ == "__main__":
 
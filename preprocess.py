@@ -0,0 +1,200 @@
+# coding=utf-8
+
+# Librerías
+from process_text import process_line, process_line2, clear_endbreak_line
+
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import os
+
+################################################################################
+# PARÁMETROS                                                                   #
+################################################################################
+
+# Signos contemplados como signos de puntuación
+PUNCTS = {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON",
+        ":": ":COLON", "?": "?QUESTIONMARK", "!": "!EXCLAMATIONMARK"}
+
+# Número de líneas que se procesan a la vez (bloque)
+LINES_PER_CHUNK = 10000
+
+# Nombre base de los ficheros de salida (processed_text.<partición>.txt)
+OUTPUT_NAME = "processed_text"
+
+# Semilla de la partición en train, dev y test
+SPLIT_SEED = 42
+
+################################################################################
+# FUNCIONES                                                                    #
+################################################################################
+
+def get_option(argv, name, default=None, type=str):
+  """
+    Obtiene el valor de una opción (--nombre valor) de la línea de comandos, o el
+    valor por defecto si no está presente.
+  """
+  if name in argv:
+    return type(argv[argv.index(name) + 1])
+  return default
+
+def read_chunks(f, chunk_size):
+  """
+    Lee un fichero por bloques de (como mucho) chunk_size líneas, sin cargarlo
+    completo en memoria.
+  """
+  while True:
+    chunk = list(itertools.islice(f, chunk_size))
+    if not chunk:
+      break
+    yield chunk
+
+def bounded_imap(pool, func, iterable, max_pending):
+  """
+    Versión ordenada de Pool.imap que mantiene como mucho max_pending elementos en
+    curso (Pool.imap consume la entrada completa de antemano, por lo que no mantiene
+    la memoria acotada).
+  """
+  pending = collections.deque()
+  for item in iterable:
+    pending.append(pool.apply_async(func, (item,)))
+    if len(pending) >= max_pending:
+      yield pending.popleft().get()
+  while pending:
+    yield pending.popleft().get()
+
+def process_chunk(args):
+  """
+    Procesa un bloque de líneas con las funciones de procesamiento de la versión 1
+    (process_line) o de la versión 2 (process_line2, sin el token de final de línea).
+
+    Parámetros
+    ----------
+    args : (list(str), int)
+        Las líneas del bloque y la versión de las funciones de procesamiento
+
+    Salida
+    ------
+    list(str)
+        Las líneas procesadas, en el mismo orden.
+  """
+  lines, version = args
+  if version == 1:
+    return [process_line(line, puncts=PUNCTS) for line in lines]
+  return [clear_endbreak_line(process_line2(line, puncts=PUNCTS)) for line in lines]
+
+def process_file(f, version, workers=1, chunk_size=LINES_PER_CHUNK):
+  """
+    Procesa las líneas de un fichero por bloques, repartiendo los bloques entre
+    workers procesos. Los bloques procesados se devuelven (generador) en el orden
+    original, y como mucho hay 2 * workers bloques en memoria a la vez.
+
+    Parámetros
+    ----------
+    f : file
+        El fichero de entrada (abierto en modo texto)
+
+    version : int
+        La versión de las funciones de procesamiento (1 ó 2, ver process_chunk)
+
+    workers : int, optional
+        Número de procesos. Por defecto 1 (en el propio proceso)
+
+    chunk_size : int, optional
+        Número de líneas de cada bloque. Por defecto LINES_PER_CHUNK
+
+    Salida
+    ------
+    generator(list(str))
+        Los bloques de líneas procesadas.
+  """
+  chunks = ((chunk, version) for chunk in read_chunks(f, chunk_size))
+  if workers <= 1:
+    yield from map(process_chunk, chunks)
+    return
+
+  with multiprocessing.Pool(workers) as pool:
+    yield from bounded_imap(pool, process_chunk, chunks, 2 * workers)
+
+def split_of(line, test_size, dev_test_size=None, seed=SPLIT_SEED):
+  """
+    Asigna una línea a la partición de entrenamiento, dev o test de forma determinista a
+    partir de un hash (independiente del proceso y de la máquina) de la semilla y la línea,
+    que se toma como un número uniforme u en [0, 1). Como la asignación sólo depende de la
+    línea, la partición se hace en streaming (sin cargar el conjunto de datos en memoria),
+    es reproducible, y las líneas repetidas caen siempre en la misma partición.
+
+    Parámetros
+    ----------
+    line : str
+        La línea (procesada)
+
+    test_size : float
+        Proporción de líneas no tomadas para entrenamiento
+
+    dev_test_size : float, optional
+        Proporción de líneas tomadas para test sobre las no tomadas para entrenamiento.
+        Si no se indica, todas ellas van a dev
+
+    seed : int, optional
+        La semilla de la partición. Por defecto SPLIT_SEED
+
+    Salida
+    ------
+    str
+        La partición: "train", "dev" o "test".
+  """
+  digest = hashlib.blake2b(f"{seed}\n{line}".encode("utf-8"), digest_size=8).digest()
+  u = int.from_bytes(digest, "big") / 2**64
+  if u >= test_size:
+    return "train"
+  if dev_test_size is not None and u < test_size * dev_test_size:
+    return "test"
+  return "dev"
+
+class ShardWriter(object):
+  """
+    Escritor de las líneas de una partición (train, dev o test) en el directorio de
+    salida. Si no se indica shard_lines, escribe el fichero processed_text.<partición>.txt.
+    Si no, lo divide en fragmentos (shards) de shard_lines líneas, numerados en orden:
+    processed_text.00000.<partición>.txt, processed_text.00001.<partición>.txt, ...
+    (data.create_dev_test_train_split_and_vocabulary los procesa en ese orden).
+    Las líneas se escriben según se reciben.
+  """
+
+  def __init__(self, output_dir, split, shard_lines=None):
+    self.output_dir = output_dir
+    self.split = split
+    self.shard_lines = shard_lines
+    self.num_lines = 0
+    self.num_shards = 0
+    self.file = None
+
+  def _open_next(self):
+    if self.file is not None:
+      self.file.close()
+    if self.shard_lines is None:
+      name = f"{OUTPUT_NAME}.{self.split}.txt"
+    else:
+      name = f"{OUTPUT_NAME}.{self.num_shards:05d}.{self.split}.txt"
+    self.file = open(os.path.join(self.output_dir, name), "w", encoding="utf-8")
+    self.num_shards += 1
+
+  def write(self, line):
+    if self.file is None or (self.shard_lines is not None and self.num_lines % self.shard_lines == 0):
+      self._open_next()
+    self.file.write("%s\n" % line)
+    self.num_lines += 1
+
+  def close(self):
+    # Aunque no haya líneas se crea el fichero de la partición
+    if self.file is None:
+      self._open_next()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
@@ -4,6 +4,7 @@
 # Librerías
 import os
 from io import open
+from functools import lru_cache
 import re
 import sys
 
@@ -11,6 +12,65 @@ import sys
 # FUNCIONES                                                                    #
 ################################################################################
 
+def character_ranges(chars):
+  """
+    Expresa un conjunto de caracteres como clase de expresión regular, agrupando los
+    caracteres consecutivos en rangos (a-z).
+  """
+  codes = sorted(map(ord, chars))
+  res = []
+  i = 0
+  while i < len(codes):
+    j = i
+    while j + 1 < len(codes) and codes[j + 1] == codes[j] + 1:
+      j += 1
+    res.append(re.escape(chr(codes[i])) + ('-' + re.escape(chr(codes[j])) if j > i else ''))
+    i = j + 1
+  return ''.join(res)
+
+# Clase de los caracteres que str.isdigit() considera numéricos: los dígitos decimales de \d
+# y otros como los superíndices. Así la tokenización separa números y cadenas exactamente 
+# igual que la versión carácter a carácter
+DIGITS = '\\d' + character_ranges(c for c in map(chr, range(sys.maxunicode + 1)) if c.isdigit() and not re.fullmatch(r'\d', c))
+
+# Expresión (precompilada) de los términos numéricos
+NUMBER = re.compile(r'\d+')
+
+@lru_cache(maxsize=None)
+def token_pattern(puncts, spaces, ascii):
+  """
+    Construye (una única vez para cada conjunto de signos de puntuación) la expresión regular 
+    de tokenización. Los tokens son los signos de puntuación, las secuencias de caracteres 
+    numéricos y las secuencias de caracteres no numéricos entre separadores (espacios y signos
+    de puntuación).
+
+    Parámetros
+    ----------
+    puncts : str
+        Los símbolos considerados como símbolos de puntuación
+
+    spaces : bool
+        Si los espacios se consideran tokens (tokenize2) o no (tokenize). En el segundo caso, 
+        las secuencias formadas únicamente por otros espacios en blanco (tabuladores, etc.) 
+        tampoco son tokens, salvo que les siga un número
+
+    ascii : bool
+        Si la expresión se aplicará sólo a cadenas ASCII, en cuyo caso la clase de los 
+        caracteres numéricos se reduce a 0-9 (más rápida)
+
+    Salida
+    ------
+    re.Pattern
+        La expresión regular compilada.
+
+  """
+  separators = re.escape(' ' + puncts)
+  digits = '0-9' if ascii else DIGITS
+  word = f'[^{separators}{digits}]'
+  if spaces:
+    return re.compile(f'{word}+|[{separators}]|[{digits}]+')
+  return re.compile(f'{word}*[^{separators}{digits}\\s]{word}*|{word}+(?=[{digits}])|[{re.escape(puncts)}]|[{digits}]+')
+
 def tokenize(sent, puncts=[',', '.', ';', ':', '?', '!']):
   """
     Corresponde a la función de tokenización de frases con respecto a un conjunto 
@@ -32,67 +92,9 @@ def tokenize(sent, puncts=[',', '.', ';', ':', '?', '!']):
         La lista de tokens asociado.
 
   """
-  # Inicializamos una lista vacía que contendrá, en cada paso, los tokens
-  # completos procesados hasta el momento.
-  res = []
-
-  # Se inicializa una cadena vacía que contendrá, en cada paso, la secuencia
-  # parcial de caractéres de la cadena del token en procesamiento. 
-  partial = ''
-
-  # Guardamos el tipo de datos del último carácter de partial
-  # que lo identifica como numérico o no numérico (cadena)
-  cur_read_type = None
-  
-  # En cada paso (hasta terminar de procesar todos los caracteres de la cadena)
-  for i in range(len(sent)):
-    
-    # Se lee el carácter i-ésimo de la cadena
-    c_i = sent[i] 
-    
-    # Si dicho carácter corresponde a un espacio o a un signo de puntuación
-    # entonces, el token que estábamos procesando finaliza, luego
-    if c_i == ' '  or c_i in puncts:
-      
-      # Ha de añadirse (junto al signo de corte), como nuevos tokens.
-      # Sólo se añadirá no es vacío ( si no corresponde al espacio, resp.). 
-      res += list(filter(lambda x: x.strip() != '', [partial.lower(), c_i]))
-      
-      # Y reseteamos la cadena parcial de token a vacío
-      partial = ''
-      cur_read_type = None
-    
-    # En otro caso, 
-    else:
-      # Añadimos el carácter a la cadena parcial del token procesamiento
-      # si los tipos no coinciden entendemos que corresponden a cadenas distintas
-      # Y por ende, partimos guardamos el token anterior e inicializamos uno nuevo
-      # con el carácter leído y su tipo
-      if (c_i.isdigit()):
-          if(cur_read_type == 'string'):
-            res += [partial.lower()]
-            partial = ''
-              
-          cur_read_type = 'number'
-      
-      else:
-          if(cur_read_type == 'number'):
-            res += [partial.lower()]
-            partial = ''
-   
-          cur_read_type = 'string'
-      
-      
-      partial += c_i
-    
-    #Se continúa el procesamiento del siguiente carácter.
-  
-  # El token leído en última instancia es añadido a la lista de tokens (siempre
-  # que no sea vacío)
-  res += [partial.lower()] if partial.strip() != '' else []
-
-  # Finalmente, se devuelve la lista de tokens
-  return res
+  # La frase se tokeniza en una única pasada de la expresión regular (ver token_pattern) y
+  # cada token se pasa a minúscula
+  return [token.lower() for token in token_pattern(''.join(p for p in puncts if p.strip() != ''), False, sent.isascii()).findall(sent)]
 
   # Nótese que se consideran todas las cadenas en minúscula
 
@@ -120,70 +122,17 @@ def tokenize2(sent, puncts={".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON",
         La lista de tokens asociado.
 
   """
+  # La frase se tokeniza en una única pasada de la expresión regular (ver token_pattern),
+  # sustituyendo cada signo de puntuación por su token
+  res = [puncts.get(token, token) for token in token_pattern(''.join(puncts), True, sent.isascii()).findall(sent)]
 
-  # Inicializamos una lista vacía que contendrá, en cada paso, los tokens
-  # completos procesados hasta el momento.
-  res = []
-
-  # Se inicializa una cadena vacía que contendrá, en cada paso, la secuencia
-  # parcial de caractéres de la cadena del token en procesamiento. 
-  partial = ''
-
-  # Reading type
-  cur_read_type = None
-  
-  # En cada paso (hasta terminar de procesar todos los caracteres de la cadena)
-  for i in range(len(sent)):
-    
-    # Se lee el carácter i-ésimo de la cadena
-    c_i = sent[i] 
-    
-    # Si dicho carácter corresponde a un espacio o a un signo de puntuación
-    # entonces, el token que estábamos procesando finaliza, luego
-    if c_i == ' ' or c_i in puncts:
-      
-      # Ha de añadirse (junto al signo de corte), como nuevos tokens.
-      # Sólo se añadirá no es vacío ( si no corresponde al espacio, resp.).
-      if partial:
-        res.append(partial)
-         
-      res.append(puncts[c_i] if c_i != ' ' else c_i)
-      
-      # Y reseteamos la cadena parcial de token a vacío
-      partial = ''
-      cur_read_type = None
-    
-    # En otro caso, 
-    else:
-      # Añadimos el carácter a la cadena parcial del token procesamiento
-      # si los tipos no coinciden entendemos que corresponden a cadenas distintas
-      # Y por ende, partimos guardamos el token anterior e inicializamos uno nuevo
-      # con el carácter leído y su tipo
-      if (c_i.isdigit()):
-          if(cur_read_type == 'string'):
-            res += [partial]
-            partial = ''
-              
-          cur_read_type = 'number'
-      
-      else:
-          if(cur_read_type == 'number'):
-            res += [partial]
-            partial = ''
-   
-          cur_read_type = 'string'
-      
-      
-      partial += c_i
-    
-    #Se continúa el procesamiento del siguiente carácter.
-  
-  # El token leído en última instancia es añadido a la lista de tokens (siempre
-  # que no sea vacío)
-  res += [partial] if partial.strip() != '' else []
+  # Una secuencia formada sólo por espacios en blanco (tabuladores, etc.) al final de la 
+  # frase no es un token
+  if res and res[-1] != ' ' and res[-1].isspace():
+    res.pop()
 
   # Finalmente, se devuelve la lista de tokens
-  return res 
+  return res
 
 def process_line(line, puncts= {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON", 
         ":": ":COLON", "?": "?QUESTIONMARK", "!": "!EXCLAMATIONMARK"}):
@@ -229,7 +178,7 @@ def process_line(line, puncts= {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON"
         
         # Si el token es numérico entonces se le asigna el token de numeración
         # "<NUM>"
-        elif re.fullmatch('\d+', token):
+        elif NUMBER.fullmatch(token):
             output_tokens.append("<NUM>")
         
         # Si no, el token corresponde a una cadena, que es guardada como token 
@@ -1,12 +1,16 @@
 # coding: utf-8  # by vicramgon
 from __future__ import division
 
-import models, data, main
+import models, data
 from process_text import clear_endbreak_line
+from preprocess import get_option, read_chunks, bounded_imap
 import re
 
 import sys
+import os
 import codecs
+import multiprocessing
+import collections
 
 import tensorflow as tf
 import numpy as np
@@ -17,15 +21,110 @@ import re
 # Tamaño máximo de la secuencia 
 MAX_SUBSEQUENCE_LEN = 200
 
+# Número máximo de subsecuencias que se procesan en cada llamada al modelo
+BATCH_SIZE = 128
+
+# Número de líneas del fichero de entrada que se restauran a la vez (bloque)
+LINES_PER_CHUNK = 1024
+
 # Signos de puntuación de fin de frase o intermedios
 EOS_PUNCTS = {".": ".PERIOD", "?": "?QUESTIONMARK", "!": "!EXCLAMATIONMARK"}
 INS_PUNCTS = {",": ",COMMA", ";": ";SEMICOLON", ":": ":COLON"}
 
+# Función de preparación de una línea de entrada: se eliminan las puntuaciones y se añade el token del final
+def prepare_line(line, punctuation_vocabulary):
+    input_text = re.sub('\s+', ' ', line.strip())
+    return [w for w in input_text.split() if w not in punctuation_vocabulary and w not in data.PUNCTUATION_MAPPING] + ["<BREAK>", data.END]
+
+# Expresión (precompilada) de los términos numéricos, que se vectorizan como "<NUM>"
+NUMBER = re.compile(r'\d+')
+
 # Función para pasar a un array columna
 def to_array(arr, dtype=np.int32):
     # minibatch of 1 sequence as column
     return np.array([arr], dtype=dtype).T
 
+# Función de vectorización de una subsecuencia de acuerdo al vocabulario de términos
+def convert_subsequence(subsequence, word_vocabulary):
+    num, unk = word_vocabulary["<NUM>"], word_vocabulary[data.UNK]
+    return np.array([num if NUMBER.fullmatch(w) else word_vocabulary.get(w, unk) for w in subsequence], dtype=np.int32)
+
+# Función que construye, a partir del vocabulario inverso de puntuaciones, las tablas (indexadas por
+# id de puntuación) con el símbolo que se escribe y con las puntuaciones de fin de frase
+def punctuation_tables(reverse_punctuation_vocabulary):
+    size = max(reverse_punctuation_vocabulary) + 1
+    marks = np.full(size, ' ', dtype=object)
+    is_eos = np.zeros(size, dtype=bool)
+    for p_i, punctuation in reverse_punctuation_vocabulary.items():
+        marks[p_i] = ' ' if punctuation == data.SPACE else punctuation[0]
+        is_eos[p_i] = punctuation in data.EOS_TOKENS
+    return marks, is_eos
+
+# Función de reconstrucción del texto de una subsecuencia a partir de las puntuaciones predichas
+def decode_subsequence(subsequence, converted_subsequence, punctuation_ids, punctuation_tables, word_vocabulary, step=None):
+    """
+    Construye el fragmento de texto puntuado y capitalizado correspondiente a una 
+    subsecuencia, a partir de los ids de puntuación predichos para ella.
+
+    Parámetros
+    ----------
+    subsequence : list(str)
+        Los términos de la subsecuencia
+
+    converted_subsequence : numpy.ndarray(int)
+        La vectorización de la subsecuencia según el vocabulario de términos
+
+    punctuation_ids : numpy.ndarray(int)
+        Los ids de las puntuaciones predichas tras cada término de la subsecuencia 
+        (uno menos que el número de términos)
+
+    punctuation_tables : (numpy.ndarray(str), numpy.ndarray(bool))
+        Las tablas de símbolos y de puntuaciones de fin de frase (ver punctuation_tables)
+
+    word_vocabulary : dict(str,int)
+        Vocabulario de términos utilizado en el modelo
+
+    step : int, optional
+        Número de términos que se consumen. Por defecto, hasta la última puntuación final
+        predicha o, en su defecto, hasta el final de la subsecuencia
+
+    Salida
+    ------
+    (str, int)
+        El fragmento restaurado y el número de términos consumidos (step), esto es,
+        el desplazamiento hasta el inicio de la siguiente subsecuencia.
+
+  """
+    marks, is_eos = punctuation_tables
+    eos = is_eos[punctuation_ids]
+
+    # Si se ha generado algún signo de puntuación final, se establece la marca step al 
+    # índice siguiente al último generado. Y si no, al final de la subsecuencia
+    if step is None:
+        eos_positions = np.flatnonzero(eos)
+        step = int(eos_positions[-1]) + 1 if len(eos_positions) > 0 else len(subsequence) - 1
+
+    # se añade el primer término de la subsecuencia (para la que no hay predicción) 
+    pieces = [subsequence[0]]
+    if step == 0:
+        return pieces[0], step
+
+    # Los términos siguientes a una puntuación final o que corresponden al token "<UNK>" 
+    # se inician en mayúscula, el resto se escriben en minúscula
+    capitalized = eos[:step-1] | (converted_subsequence[1:step] == word_vocabulary[data.UNK])
+    for mark, w, upper in zip(marks[punctuation_ids[:step-1]], subsequence[1:step], capitalized):
+        pieces.append(mark)
+        pieces.append(' ' + w[0].upper() + (w[1:].lower() if len(w) > 1 else ' ') if upper else ' ' + w.lower())
+
+    # Tras el último término solo se añade el símbolo de puntuación
+    pieces.append(marks[punctuation_ids[step-1]] + ('  ' if eos[step-1] else ' '))
+
+    return "".join(pieces), step
+
+# Función de capitalización de la primera palabra del texto restaurado
+def capitalize(res):
+    return res[0].upper() + (res[1:] if len(res) > 1 else ' ')
+
 # Función de restauración de la puntuación
 def restore(text, word_vocabulary, reverse_punctuation_vocabulary, model):
     """
@@ -59,8 +158,10 @@ def restore(text, word_vocabulary, reverse_punctuation_vocabulary, model):
     # analizando
     i = 0
 
-    # Inicializamos una cadena que servirá como almacén de la frase restaurada
-    res = ""
+    # Inicializamos la lista de fragmentos que servirá como almacén de la frase restaurada
+    res = []
+
+    tables = punctuation_tables(reverse_punctuation_vocabulary)
 
     # Mientras no se haya llegado al final del texto
     while True:
@@ -74,65 +175,20 @@ def restore(text, word_vocabulary, reverse_punctuation_vocabulary, model):
             break
 
         # Se vectoriza la subsecuencia correspondiente
-        converted_subsequence = [ word_vocabulary["<NUM>"] if re.fullmatch('\d+', w) else word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence]
+        converted_subsequence = convert_subsequence(subsequence, word_vocabulary)
 
         # y se obtienen las probabilidades para cada signo de puntuación y cada término de la secuencia
         # otorgadas por el modelo predictor.
         y = predict(to_array(converted_subsequence), model)
 
-        # se añade el primer término de la subsecuencia (para la que no hay predicción) 
-        res += subsequence[0]
-
-        # se establece una marca del último símbolo de puntuación final que se ha generado
-        last_eos_idx = 0
-
         # Se obtienen los signos de puntuación asignados a cada uno de los términos de la 
-        # secuencia.
-        punctuations = []
-        for y_t in y:
-            # Para ello, se considera como signo de puntuación aquél que maximiza la probabilidad 
-            # en base a las probabilidades dadas por el predictor
-            p_i = np.argmax(tf.reshape(y_t, [-1]))
-            punctuation = reverse_punctuation_vocabulary[p_i]
+        # secuencia. Para ello, se considera como signo de puntuación aquél que maximiza la 
+        # probabilidad en base a las probabilidades dadas por el predictor
+        punctuation_ids = np.argmax(y, axis=-1)[:, 0]
 
-            punctuations.append(punctuation)
-
-
-            # Se actualiza la marca correspondiente al último signo de puntuación final generado
-            # (en realidad el índice siguiente a dicho signo de puntuación)
-            if punctuation in data.EOS_TOKENS:
-                last_eos_idx = len(punctuations) 
-        
-
-
-        # Si se ha generado algún signo de puntuación final, se establece la marca
-        # step al último generado
-        if last_eos_idx != 0:
-            step = last_eos_idx
-        # Y si no, al final de la subsecuencia
-        else:
-            step = len(subsequence) - 1
-
-        # Durante step pasos (hasta el último signo de puntuación o en su defecto hasta el final de la susecuencia)
-        for j in range(step):
-            # Si el símbolo de puntuación correspondiente es final
-            if punctuations[j][0] in EOS_PUNCTS:
-                # Entonces se añade el símbolo (no el token) y el término siguiente, iniciándolo en mayúscula.
-                head = ' ' + subsequence[1+j][0].upper() if j < step - 1 else ' '
-                tail = subsequence[1+j][1:].lower() if j < step - 1 and len(subsequence[1+j]) > 1 else ' '
-                res += punctuations[j][0] + head + tail
-            
-            # Si la palabra siguiente corresponde a un token "<UNK>" entonces se establece en mayúscula 
-            elif j < step - 1 and converted_subsequence[1+j] == word_vocabulary[data.UNK]:
-                # Entonces se añade el símbolo (no el token) y el término siguiente, iniciándolo en mayúscula.
-                head = ' ' if punctuations[j] == data.SPACE else punctuations[j][0]
-                tail = ' ' + subsequence[1+j][0].upper() + (subsequence[1+j][1:].lower() if len(subsequence[1+j]) > 1 else ' ')
-                res += head + tail 
-            else:
-                # En otro caso se añade el símbolo (no el token) y el término en minúscula
-                head = ' ' if punctuations[j] == data.SPACE else punctuations[j][0]
-                tail = ' ' + subsequence[j+1].lower() if j < step - 1 else ' '
-                res += head + tail
+        # Se reconstruye el fragmento de texto correspondiente
+        piece, step = decode_subsequence(subsequence, converted_subsequence, punctuation_ids, tables, word_vocabulary)
+        res.append(piece)
 
         # Si se ha llegado al final del texto, el bucle finaliza
         if subsequence[-1] == data.END:
@@ -143,11 +199,260 @@ def restore(text, word_vocabulary, reverse_punctuation_vocabulary, model):
         i += step
 
     # Finalmente, se capitaliza la primera palabra de la frase
-    return res[0].upper() + (res[1:] if len(res) > 1 else ' ')
+    return capitalize("".join(res))
+
+# Función de restauración de la puntuación de varios textos a la vez
+def restore_batch(texts, word_vocabulary, reverse_punctuation_vocabulary, model, batch_size=BATCH_SIZE, stats=None):
+    """
+    Versión por lotes de restore. Los textos avanzan a la vez, subsecuencia a
+    subsecuencia: en cada ronda se toma la subsecuencia actual de cada texto
+    pendiente, se agrupan las de longitud similar en matrices [longitud, batch_size]
+    (rellenando las más cortas e indicando al modelo la longitud real de cada una)
+    y se realiza una única llamada al modelo por lote. Las puntuaciones predichas
+    se devuelven a cada texto, que avanza igual que en restore, por lo que el 
+    resultado es el mismo que el de aplicar restore a cada texto.
+
+    Parámetros
+    ----------
+    texts : list(list(str))
+        Los textos (ya tokenizados y terminados en data.END) para ser puntuados y 
+        capitalizados
+
+    word_vocabulary : dict(str,int)
+        Vocabulario de términos utilizado en el modelo
+
+    reverse_punctuation_vocabulary : dict(int,str)
+        Vocabulario inverso de puntuaciones utilizado en el modelo
+
+    model : models.GRU
+        Modelo predictor 
+
+    batch_size : int, optional
+        Número máximo de subsecuencias por llamada al modelo. Por defecto BATCH_SIZE
+
+    stats : collections.Counter, optional
+        Si se indica, se acumulan en él los términos de entrada ("input_tokens") y los 
+        términos procesados por el modelo ("processed_tokens")
+
+    Salida
+    ------
+    list(str)
+        Los textos restaurados, en el mismo orden que los de entrada.
+
+  """
+    tables = punctuation_tables(reverse_punctuation_vocabulary)
+
+    # Cada texto se vectoriza una única vez (las subsecuencias son vistas de esta vectorización)
+    converted_texts = [convert_subsequence(text, word_vocabulary) for text in texts]
+
+    # Posición actual y fragmentos restaurados de cada uno de los textos
+    positions = [0] * len(texts)
+    results = [[] for _ in texts]
+
+    # Índices de los textos que aún no se han terminado de procesar
+    pending = list(range(len(texts)))
+
+    while pending:
+        # Se toman las subsecuencias actuales de los textos pendientes y se ordenan por longitud,
+        # de forma que cada lote agrupe subsecuencias de longitud similar y se desperdicie poco 
+        # cómputo en el relleno (padding)
+        windows = []
+        for k in pending:
+            subsequence = texts[k][positions[k]:positions[k]+MAX_SUBSEQUENCE_LEN]
+            if len(subsequence) > 0:
+                windows.append((k, subsequence))
+        windows.sort(key=lambda window: len(window[1]))
+
+        pending = []
+        for b in range(0, len(windows), batch_size):
+            chunk = windows[b:b+batch_size]
+            converted = [converted_texts[k][positions[k]:positions[k]+len(subsequence)] for k, subsequence in chunk]
+            lengths = np.array([len(converted_subsequence) for converted_subsequence in converted], dtype=np.int32)
+            if stats is not None:
+                stats["processed_tokens"] += int(lengths.sum())
+
+            # Una única llamada al modelo para todo el lote (las subsecuencias como columnas, rellenas
+            # hasta la longitud de la mayor). Una subsecuencia de un único término no tiene ninguna 
+            # puntuación que predecir.
+            if lengths[-1] > 1:
+                x = np.full((lengths[-1], len(chunk)), word_vocabulary[data.END], dtype=np.int32)
+                for col, converted_subsequence in enumerate(converted):
+                    x[:len(converted_subsequence), col] = converted_subsequence
+                punctuation_ids = np.argmax(predict(x, model, lengths), axis=-1)
+            else:
+                punctuation_ids = np.zeros((0, len(chunk)), dtype=np.int64)
+
+            # Se reparten las decisiones entre los textos correspondientes (descartando las del relleno)
+            for col, ((k, subsequence), converted_subsequence) in enumerate(zip(chunk, converted)):
+                piece, step = decode_subsequence(subsequence, converted_subsequence, punctuation_ids[:len(subsequence)-1, col], tables, word_vocabulary)
+                results[k].append(piece)
+
+                if subsequence[-1] != data.END:
+                    positions[k] += step
+                    pending.append(k)
+
+    if stats is not None:
+        stats["input_tokens"] += sum(len(text) for text in texts)
+
+    return [capitalize("".join(res)) for res in results]
+
+# Comprobación del solapamiento entre ventanas: con al menos un término compartido, todos
+# los huecos entre términos quedan dentro de alguna ventana
+def check_overlap(overlap):
+    if not 1 <= overlap < MAX_SUBSEQUENCE_LEN - 1:
+        raise ValueError(f"The overlap must be between 1 and {MAX_SUBSEQUENCE_LEN - 2}")
+
+# Función de cálculo de las ventanas (inicio, longitud) de paso fijo que cubren un texto de n términos
+def overlapping_windows(n, overlap):
+    stride = MAX_SUBSEQUENCE_LEN - overlap
+    windows = []
+    start = 0
+    while True:
+        windows.append((start, min(n, start + MAX_SUBSEQUENCE_LEN) - start))
+        if start + MAX_SUBSEQUENCE_LEN >= n:
+            return windows
+        start += stride
+
+# Función de restauración de la puntuación de textos largos mediante ventanas solapadas
+def restore_overlapping(texts, word_vocabulary, reverse_punctuation_vocabulary, model, overlap, batch_size=BATCH_SIZE, stats=None):
+    """
+    Modo para documentos largos. En lugar de reiniciar cada subsecuencia en la última
+    puntuación final predicha (lo que vuelve a procesar la cola de la subsecuencia 
+    anterior), cada texto se cubre con ventanas de MAX_SUBSEQUENCE_LEN términos y paso
+    fijo MAX_SUBSEQUENCE_LEN - overlap, por lo que el número de términos procesados está 
+    acotado de antemano. Todas las ventanas de todos los textos se agrupan en lotes, y 
+    para cada hueco entre términos se toma la predicción de la ventana más segura (mayor
+    probabilidad de la puntuación elegida); en caso de empate, la de la ventana anterior.
+
+    Parámetros
+    ----------
+    texts : list(list(str))
+        Los textos (ya tokenizados y terminados en data.END) para ser puntuados y 
+        capitalizados
+
+    word_vocabulary : dict(str,int)
+        Vocabulario de términos utilizado en el modelo
+
+    reverse_punctuation_vocabulary : dict(int,str)
+        Vocabulario inverso de puntuaciones utilizado en el modelo
+
+    model : models.GRU
+        Modelo predictor 
+
+    overlap : int
+        Número de términos que comparten dos ventanas consecutivas (entre 1 y MAX_SUBSEQUENCE_LEN - 2)
+
+    batch_size : int, optional
+        Número máximo de ventanas por llamada al modelo. Por defecto BATCH_SIZE
+
+    stats : collections.Counter, optional
+        Si se indica, se acumulan en él los términos de entrada ("input_tokens") y los 
+        términos procesados por el modelo ("processed_tokens")
+
+    Salida
+    ------
+    list(str)
+        Los textos restaurados, en el mismo orden que los de entrada.
+
+  """
+    check_overlap(overlap)
+
+    tables = punctuation_tables(reverse_punctuation_vocabulary)
+    converted_texts = [convert_subsequence(text, word_vocabulary) for text in texts]
+
+    # Ventanas (texto, inicio, longitud) de todos los textos, ordenadas por longitud para los lotes
+    windows = [(k, start, length) for k, text in enumerate(texts) for start, length in overlapping_windows(len(text), overlap)]
+    batches = sorted(range(len(windows)), key=lambda w: windows[w][2])
+
+    # Probabilidades predichas por cada ventana (una por hueco entre términos)
+    outputs = [None] * len(windows)
+    for b in range(0, len(batches), batch_size):
+        chunk = batches[b:b+batch_size]
+        lengths = np.array([windows[w][2] for w in chunk], dtype=np.int32)
+        if stats is not None:
+            stats["processed_tokens"] += int(lengths.sum())
+
+        # Una ventana de un único término (un texto de un término) no tiene ninguna puntuación que predecir
+        if lengths[-1] > 1:
+            x = np.full((lengths[-1], len(chunk)), word_vocabulary[data.END], dtype=np.int32)
+            for col, w in enumerate(chunk):
+                k, start, length = windows[w]
+                x[:length, col] = converted_texts[k][start:start+length]
+            y = np.asarray(predict(x, model, lengths))
+        else:
+            y = np.zeros((0, len(chunk), len(reverse_punctuation_vocabulary)), dtype=np.float32)
+
+        for col, w in enumerate(chunk):
+            outputs[w] = y[:windows[w][2]-1, col]
+
+    # Fusión de las predicciones, recorriendo las ventanas de cada texto en orden
+    best = [np.zeros((len(text) - 1, len(reverse_punctuation_vocabulary)), dtype=np.float32) for text in texts]
+    confidence = [np.full(len(text) - 1, -1.0, dtype=np.float32) for text in texts]
+    for (k, start, length), y in zip(windows, outputs):
+        window_confidence = y.max(axis=-1)
+        better = window_confidence > confidence[k][start:start+length-1]
+        best[k][start:start+length-1][better] = y[better]
+        confidence[k][start:start+length-1][better] = window_confidence[better]
+
+    # Todos los huecos tienen la predicción de alguna ventana (ver check_overlap)
+    assert all((c >= 0).all() for c in confidence), "Gaps between words not covered by any window"
+
+    if stats is not None:
+        stats["input_tokens"] += sum(len(text) for text in texts)
+
+    # Cada texto se reconstruye completo, con todas sus puntuaciones
+    return [
+        capitalize(decode_subsequence(text, converted, np.argmax(p, axis=-1), tables, word_vocabulary, step=len(text) - 1)[0])
+        for text, converted, p in zip(texts, converted_texts, best)
+    ]
+
+# Función de restauración de un bloque de líneas del fichero de entrada
+# (con overlap, en el modo de ventanas solapadas para documentos largos)
+def restore_lines(lines, model, batch_size=BATCH_SIZE, overlap=None, stats=None):
+    reverse_punctuation_vocabulary = {v:k for k,v in model.y_vocabulary.items()}
+    texts = [prepare_line(l, model.y_vocabulary) for l in lines]
+    if overlap is None:
+        punct_texts = restore_batch(texts, model.x_vocabulary, reverse_punctuation_vocabulary, model, batch_size, stats)
+    else:
+        punct_texts = restore_overlapping(texts, model.x_vocabulary, reverse_punctuation_vocabulary, model, overlap, batch_size, stats)
+    return [clear_endbreak_line(punct_text) for punct_text in punct_texts]
+
+# Modelo de cada proceso trabajador (modo --workers), cargado una única vez por proceso
+worker_model = None
+
+# Función de inicialización de los procesos trabajadores
+def init_worker(model_file, quantization, threads, bf16=False):
+    global worker_model
+
+    # Los mensajes de los procesos trabajadores van a la salida de error (la salida estándar puede ser la del texto)
+    sys.stdout = sys.stderr
+
+    # Se limitan los hilos de TensorFlow del proceso para que los N procesos no compitan por los núcleos
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    worker_model, _ = models.load(model_file, None)
+    if quantization is not None:
+        models.quantize(worker_model, quantization)
+    if bf16:
+        models.set_compute_dtype(worker_model, models.BFLOAT16)
+
+# Función de restauración de un bloque de líneas, que devuelve también las estadísticas de 
+# términos procesados del bloque
+def restore_chunk(model, lines, batch_size, overlap):
+    stats = collections.Counter()
+    return restore_lines(lines, model, batch_size, overlap, stats), stats
+
+# Función de restauración de un bloque de líneas en un proceso trabajador
+def restore_lines_worker(args):
+    return restore_chunk(worker_model, *args)
 
 # La función de predicción que corresponde al softmax de las salidas dadas por la red
-def predict(x, model):
-    return tf.nn.softmax(net(x))
+# (se usa la función de inferencia compilada del modelo, ver models.GRU.reset_inference)
+def predict(x, model, lengths=None):
+    if lengths is None:
+        lengths = np.full(x.shape[1], x.shape[0], dtype=np.int32)
+    return model.infer(x, lengths)
 
 if __name__ == "__main__":
     """
@@ -163,6 +468,21 @@ if __name__ == "__main__":
       1. Ruta al archivo de texto de test (sin signos de puntuación ni mayúsculas)
       2. La ruta al modelo GRU (Model.pcl), que actuará como modelo predictor
       3. La ruta del fichero que almacenará el texto puntuado.
+
+      Las rutas de entrada y salida pueden ser "-" (entrada y salida estándar). La entrada se lee
+      y restaura por bloques, y cada bloque se vuelca a la salida en cuanto está restaurado, por
+      lo que la memoria utilizada no depende del tamaño de la entrada.
+
+      Opciones
+      --------
+      --batch-size N : número máximo de subsecuencias por llamada al modelo (por defecto BATCH_SIZE)
+      --quantize int8|float16 : cuantiza los pesos del modelo tras cargarlo (ver models.quantize)
+      --bf16 : calcula el modelo en precisión mixta, en bfloat16 salvo los softmax (ver models.set_compute_dtype)
+      --workers N : reparte los bloques de líneas entre N procesos, cada uno con su propio modelo
+      --threads N : hilos de TensorFlow de cada proceso (por defecto, los núcleos entre el número de procesos)
+      --chunk-size N : número de líneas de cada bloque (por defecto LINES_PER_CHUNK)
+      --overlap N : modo para documentos largos, con ventanas de paso fijo que se solapan N términos
+                    (ver restore_overlapping)
     """
     if len(sys.argv) > 1:
         model_file = sys.argv[1]
@@ -179,50 +499,82 @@ if __name__ == "__main__":
     else:
         sys.exit("Output file path argument missing")
 
-    # Se carga el vocabulario y se inicializa una matriz con 1s (según el tamaño del vocabulario y el batch size)
-    vocab_len = len(data.read_vocabulary(data.WORD_VOCAB_FILE))
-    x_len = vocab_len if vocab_len < data.MAX_WORD_VOCABULARY_SIZE else data.MAX_WORD_VOCABULARY_SIZE + data.MIN_WORD_COUNT_IN_VOCAB
-    x = np.ones((x_len, main.MINIBATCH_SIZE)).astype(int)
+    batch_size = get_option(sys.argv, "--batch-size", BATCH_SIZE, int)
+    quantization = get_option(sys.argv, "--quantize")
+    bf16 = "--bf16" in sys.argv
+    workers = get_option(sys.argv, "--workers", 1, int)
+    threads = get_option(sys.argv, "--threads", max(1, (os.cpu_count() or 1) // workers), int)
+    chunk_size = get_option(sys.argv, "--chunk-size", LINES_PER_CHUNK, int)
+    overlap = get_option(sys.argv, "--overlap", None, int)
+    if overlap is not None:
+        try:
+            check_overlap(overlap)
+        except ValueError as e:
+            sys.exit(str(e))
+
+    # Si el texto se escribe en la salida estándar, los mensajes se escriben en la salida de error
+    if output_file == "-":
+        fout = open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+        sys.stdout = sys.stderr
+    else:
+        fout = open(output_file, 'w', encoding='utf-8')
+
+    if input_file == "-":
+        fin = open(sys.stdin.fileno(), 'r', encoding='utf-8', closefd=False)
+    else:
+        fin = codecs.open(input_file, 'r', 'utf-8')
+
+    # Se lee la entrada por bloques de líneas contiguas
+    chunks = ((chunk, batch_size, overlap) for chunk in read_chunks(fin, chunk_size))
 
-    # Se carga el modelo
-    print("Loading model parameters...")
-    net, _ = models.load(model_file, x)
+    if workers > 1:
+        # Cada proceso carga el modelo una única vez. Los bloques se restauran en paralelo 
+        # pero se devuelven en el orden original
+        print(f"Loading model parameters in {workers} workers...")
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(model_file, quantization, threads, bf16))
+        results = bounded_imap(pool, restore_lines_worker, chunks, 2 * workers)
+    else:
+        # Se carga el modelo
+        print("Loading model parameters...")
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        net, _ = models.load(model_file, None)
 
-    print("Building model...")
+        # Si se indica, se cuantizan los pesos del modelo
+        if quantization is not None:
+            print(f"Quantizing model weights ({quantization})...")
+            models.quantize(net, quantization)
 
-    # Se construyen los vocabularios de puntuación y términos
-    word_vocabulary = net.x_vocabulary
-    punctuation_vocabulary = net.y_vocabulary
+        # Si se indica, se calcula el modelo en precisión mixta (bfloat16)
+        if bf16:
+            print("Using mixed precision (bfloat16)...")
+            models.set_compute_dtype(net, models.BFLOAT16)
 
-    reverse_word_vocabulary = {v:k for k,v in word_vocabulary.items()}
-    reverse_punctuation_vocabulary = {v:k for k,v in punctuation_vocabulary.items()}
+        results = (restore_chunk(net, *args) for args in chunks)
 
     print("Restoring punctuation...")
-    # Se leen las lineas del fichero
-    with codecs.open(input_file, 'r', 'utf-8') as f:
-        lines = f.readlines()
+    # Se puntuan y capitalizan las lineas por bloques, procesando cada bloque por lotes
+    li = 0
+    stats = collections.Counter()
+    for punct_texts, chunk_stats in results:
+        stats.update(chunk_stats)
+        print(f"line{li}")
+        # Se vuelcan al archivo de salida
+        for punct_text in punct_texts:
+            fout.write(punct_text+'\n')
+        fout.flush()
+        li += len(punct_texts)
+
+    # Términos procesados por el modelo frente a términos de entrada
+    if li > 0:
+        print(f"Tokens processed: {stats['processed_tokens']}; input tokens: {stats['input_tokens']} ({stats['processed_tokens'] / stats['input_tokens']:.2f}x)")
+
+    fin.close()
+    fout.close()
+
+    if workers > 1:
+        pool.close()
+        pool.join()
 
     # Si no tiene se aborta
-    if len(lines) == 0:
+    if li == 0:
         sys.exit("Input file empty.")
-
-    # En otro caso, se abre el fichero que almacenará las frases puntadas y capitalizadas
-    with open(output_file, 'w') as fout:
-      fout.write("")
-    with open(output_file, 'a') as fout:
-      li = 0
-      # Para cada linea
-      for l in lines:
-        if li % 1000 == 0:
-            print(f"line{li}")
-        # Se obtiene el texto
-        input_text = re.sub('\s+', ' ', l.strip())
-        # Se eliminan las puntuaciones y se añade el token del final
-        text = [w for w in input_text.split() if w not in punctuation_vocabulary and w not in data.PUNCTUATION_MAPPING] + ["<BREAK>", data.END]
-        # Se puntua y capitaliza el texto de la linea
-        punct_text = restore(text, word_vocabulary, reverse_punctuation_vocabulary, net)
-        # Se vuelca al archivo de salida
-        fout.write(clear_endbreak_line(punct_text)+'\n')
-        # Leemos la siguiente linea 
-        li += 1
-
@@ -0,0 +1,206 @@
+# coding: utf-8
+
+"""
+Local HTTP punctuation service. The model is loaded once and concurrent requests are grouped
+into micro-batches: a batch is sent to the model when it holds --max-batch lines or when the
+oldest request in it has waited --max-latency-ms, whichever comes first.
+
+python server.py Model.pcl [--host 127.0.0.1] [--port 8000] [--max-batch 64] [--max-latency-ms 10]
+                 [--batch-size N] [--quantize int8|float16] [--bf16] [--overlap N]
+
+    curl -d '{"text": "hello how are you"}' http://127.0.0.1:8000/punctuate
+    {"text": "Hello, how are you?"}
+
+The request body is a JSON object with "text" (one line) or "texts" (a list of lines), and the
+response has the same key with the restored line(s).
+"""
+
+from __future__ import division
+
+import models, punctuator
+
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import json
+import sys
+
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH_LINES = 64
+MAX_LATENCY_MS = 10
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class RestoreError(Exception):
+    """Failure of the model while restoring a batch, reported to every request in it"""
+
+class MicroBatcher(object):
+    """
+    Groups the lines of concurrent requests into batches for punctuator.restore_lines. The model
+    runs in a single worker thread, so the event loop keeps accepting requests (and filling the
+    next batch) while a batch is being restored.
+    """
+
+    def __init__(self, model, max_batch_lines=MAX_BATCH_LINES, max_latency_ms=MAX_LATENCY_MS, batch_size=punctuator.BATCH_SIZE, overlap=None):
+        self.model = model
+        self.max_batch_lines = max_batch_lines
+        self.max_latency = max_latency_ms / 1000
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def restore(self, lines):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for line in lines:
+            future = loop.create_future()
+            # The time the line was queued, the latency of a batch is measured from its oldest line
+            await self.queue.put((line, future, loop.time()))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # Lines queued while the previous batch was being restored have already waited
+            deadline = batch[0][2] + self.max_latency
+            while len(batch) < self.max_batch_lines:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            lines = [line for line, _, _ in batch]
+            try:
+                restored = await loop.run_in_executor(self.executor, punctuator.restore_lines, lines, self.model, self.batch_size, self.overlap)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(RestoreError(e))
+                continue
+            for (_, future, _), text in zip(batch, restored):
+                if not future.done():
+                    future.set_result(text)
+
+def parse_request(body):
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError('Expected a JSON object with "text" (string) or "texts" (list of strings)')
+    if "text" in request and isinstance(request["text"], str):
+        return "text", [request["text"]]
+    if "texts" in request and isinstance(request["texts"], list) and all(isinstance(text, str) for text in request["texts"]):
+        return "texts", request["texts"]
+    raise ValueError('Expected a JSON object with "text" (string) or "texts" (list of strings)')
+
+async def respond(writer, status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = [
+        f"HTTP/1.1 {status} {STATUS_REASONS[status]}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(body)}",
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+    ]
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+async def handle_connection(reader, writer, batcher):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, path, version = request_line.decode("latin-1").split(None, 2)
+
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                await respond(writer, 413, {"error": "Request body too large"}, False)
+                break
+            body = await reader.readexactly(length)
+
+            if path != "/punctuate":
+                await respond(writer, 404, {"error": f"Unknown path {path}"}, keep_alive)
+            elif method != "POST":
+                await respond(writer, 405, {"error": "Use POST"}, keep_alive)
+            else:
+                try:
+                    key, lines = parse_request(body)
+                except ValueError as e:
+                    await respond(writer, 400, {"error": str(e)}, keep_alive)
+                else:
+                    try:
+                        restored = await batcher.restore(lines)
+                    except RestoreError as e:
+                        await respond(writer, 500, {"error": f"Restoration failed: {e}"}, keep_alive)
+                    else:
+                        await respond(writer, 200, {key: restored[0] if key == "text" else restored}, keep_alive)
+
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(model, host=HOST, port=PORT, **batcher_options):
+    batcher = MicroBatcher(model, **batcher_options)
+    batcher_task = asyncio.ensure_future(batcher.run())
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, batcher), host, port)
+    print(f"Serving on http://{host}:{port}/punctuate")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher_task.cancel()
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    host = punctuator.get_option(sys.argv, "--host", HOST)
+    port = punctuator.get_option(sys.argv, "--port", PORT, int)
+    quantization = punctuator.get_option(sys.argv, "--quantize")
+    overlap = punctuator.get_option(sys.argv, "--overlap", None, int)
+    if overlap is not None:
+        try:
+            punctuator.check_overlap(overlap)
+        except ValueError as e:
+            sys.exit(str(e))
+
+    print("Loading model parameters...")
+    net, _ = models.load(model_file, None)
+    if quantization is not None:
+        print(f"Quantizing model weights ({quantization})...")
+        models.quantize(net, quantization)
+    if "--bf16" in sys.argv:
+        print("Using mixed precision (bfloat16)...")
+        models.set_compute_dtype(net, models.BFLOAT16)
+
+    try:
+        asyncio.run(serve(
+            net, host, port,
+            max_batch_lines=punctuator.get_option(sys.argv, "--max-batch", MAX_BATCH_LINES, int),
+            max_latency_ms=punctuator.get_option(sys.argv, "--max-latency-ms", MAX_LATENCY_MS, float),
+            batch_size=punctuator.get_option(sys.argv, "--batch-size", punctuator.BATCH_SIZE, int),
+            overlap=overlap
+        ))
+    except KeyboardInterrupt:
+        pass
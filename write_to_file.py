@@ -1,16 +1,12 @@
 # coding = utf-8
 # Adaptado por vicramgon
 
-from process_text import process_line
-from sklearn.model_selection import train_test_split
+from preprocess import process_file, get_option, split_of, ShardWriter, LINES_PER_CHUNK, SPLIT_SEED
+import os
 import sys
 
 # Se procesan los datos de ejemplo dados según los métodos de procesamiento
-# presentes en process_text
-
-# Signos contemplados como signos de puntuación
-PUNCTS = {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON", 
-        ":": ":COLON", "?": "?QUESTIONMARK", "!": "!EXCLAMATIONMARK"}
+# presentes en process_text (ver preprocess.py)
 
 """
   SCRIPT
@@ -34,6 +30,18 @@ PUNCTS = {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON",
   de test. Si no, si 4 no está presente se considerá que corresponde a la partición
   para entrenamiento y evaluación.
 
+  Opciones
+  --------
+  --workers N : número de procesos entre los que se reparten los bloques de líneas
+                (por defecto, el número de núcleos)
+  --chunk-size N : número de líneas de cada bloque (por defecto preprocess.LINES_PER_CHUNK)
+  --shard-lines N : divide cada partición en fragmentos de N líneas (ver preprocess.ShardWriter)
+  --seed N : semilla de la partición (por defecto preprocess.SPLIT_SEED)
+
+  El fichero se lee y procesa por bloques, y cada línea procesada se asigna a su partición
+  (ver preprocess.split_of) y se escribe según se procesa, por lo que la memoria utilizada
+  no depende del tamaño del fichero.
+
   Salida
   ------
     str
@@ -41,60 +49,48 @@ PUNCTS = {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON",
 """
 
 
-try:
-    # Se lee el fichero con los ejemplos (en caso de que exista y corresponda a
-    # un fichero de texto)
-    if len(sys.argv) > 1:
-        float(sys.argv[1])
-        print("There is no specified text to process")
-        sys.exit(0)
-except ValueError:
-    with open(sys.argv[1], "r") as file:
-        lines = file.readlines()
-
-if not isinstance(lines[0], str):
-    print("The input text needs to be a list of strings")
-    sys.exit(0)
-   
-print(f"Number of rows in file: {len(lines)}")
-
-#Se procesa cada una de las lineas del fichero
-processed_text = [process_line(elem, puncts=PUNCTS) for elem in lines]
-print("Done processing the text")
-
-
-# Se separa el conjunto de ejemplos en train, dev y test, según los parámetros
-# recibidos.
-if len(sys.argv) > 4:
-    train_text, tmp_text = train_test_split(
-        processed_text, test_size=float(sys.argv[3]), random_state=42
-    )
-    dev_text, test_text = train_test_split(
-        tmp_text, test_size=float(sys.argv[4]), random_state=42
-    )
-
-elif len(sys.argv) == 4:
-    train_text, dev_text = train_test_split(
-        processed_text, test_size=float(sys.argv[3]), random_state=42
-    )
-
-else:
-    test_text = processed_text
-
-# Se escriben los documentos con los ejemplos correspondientes en los archivos del
-# directorio pasado como parámetro.
-if len(sys.argv) >= 4:
-  with open(sys.argv[2] + "/processed_text.train.txt", "w", encoding="utf-8") as train_file:
-      for item in train_text:
-          train_file.write("%s\n" % item)
-
-  with open(sys.argv[2] + "/processed_text.dev.txt", "w", encoding="utf-8") as dev_file:
-      for item in dev_text:
-          dev_file.write("%s\n" % item)
-
-if len(sys.argv) != 4:
-  with open(sys.argv[2] + "/processed_text.test.txt", "w", encoding="utf-8") as test_file:
-      for item in test_text:
-          test_file.write("%s\n" % item)
-
-print("Done saving files to data directory")
\ No newline at end of file
+if __name__ == "__main__":
+
+    try:
+        # Se lee el fichero con los ejemplos (en caso de que exista y corresponda a
+        # un fichero de texto)
+        if len(sys.argv) > 1:
+            float(sys.argv[1])
+            print("There is no specified text to process")
+            sys.exit(0)
+    except ValueError:
+        input_file = sys.argv[1]
+
+    workers = get_option(sys.argv, "--workers", os.cpu_count() or 1, int)
+    chunk_size = get_option(sys.argv, "--chunk-size", LINES_PER_CHUNK, int)
+    shard_lines = get_option(sys.argv, "--shard-lines", None, int)
+
+    # Los parámetros posicionales (sin las opciones)
+    args = [arg for i, arg in enumerate(sys.argv) if not arg.startswith("--") and (i == 0 or not sys.argv[i - 1].startswith("--"))]
+
+    seed = get_option(sys.argv, "--seed", SPLIT_SEED, int)
+
+    # Se establecen las particiones según los parámetros recibidos
+    if len(args) > 4:
+        splits, test_size, dev_test_size = ["train", "dev", "test"], float(args[3]), float(args[4])
+    elif len(args) == 4:
+        splits, test_size, dev_test_size = ["train", "dev"], float(args[3]), None
+    else:
+        splits = ["test"]
+
+    # Se procesa cada una de las lineas del fichero, por bloques repartidos entre los procesos,
+    # y se escribe en el fichero de su partición
+    writers = {split: ShardWriter(args[2], split, shard_lines) for split in splits}
+    with open(input_file, "r", encoding="utf-8") as file:
+        for chunk in process_file(file, 1, workers, chunk_size):
+            for item in chunk:
+                writers[split_of(item, test_size, dev_test_size, seed) if len(splits) > 1 else "test"].write(item)
+
+    for writer in writers.values():
+        writer.close()
+
+    print(f"Number of rows in file: {sum(writer.num_lines for writer in writers.values())}")
+    print("Done processing the text")
+    for split, writer in writers.items():
+        print(f"{split}: {writer.num_lines} rows")
+    print("Done saving files to data directory")
@@ -1,14 +1,10 @@
 # coding = utf-8
 # adapted by vicramgon
 
-from process_text import process_line2, clear_endbreak_line
-from sklearn.model_selection import train_test_split
+from preprocess import process_file, get_option, ShardWriter, LINES_PER_CHUNK
+import os
 import sys
 
-# Signos contemplados como signos de puntuación
-PUNCTS = {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON", 
-        ":": ":COLON", "?": "?QUESTIONMARK", "!": "!EXCLAMATIONMARK"}
-
 """
   SCRIPT
 
@@ -30,31 +26,39 @@ PUNCTS = {".": ".PERIOD", ",": ",COMMA", ";": ";SEMICOLON",
   Si el 3 y el 4 no están presentes se considerará que corresponde todo al conjunto
   de test. Si no, si 4 no está presente se considerá que corresponde a la partición
   para entrenamiento y evaluación.
-"""
 
-# We process the input text according to the processing script
+  Opciones
+  --------
+  --workers N : número de procesos entre los que se reparten los bloques de líneas
+                (por defecto, el número de núcleos)
+  --chunk-size N : número de líneas de cada bloque (por defecto LINES_PER_CHUNK)
+  --shard-lines N : divide la salida en fragmentos de N líneas (ver preprocess.ShardWriter)
+
+  El fichero se lee, procesa y escribe por bloques, por lo que la memoria utilizada
+  no depende de su tamaño.
+"""
 
-try:
-    if len(sys.argv) > 1:
-        float(sys.argv[1])
-        print("There is no specified text to process")
-        sys.exit(0)
-except ValueError:
-    with open(sys.argv[1], "r") as file:
-        lines = file.readlines()
+if __name__ == "__main__":
+    # We process the input text according to the processing script
 
-if not isinstance(lines[0], str):
-    print("The input text needs to be a list of strings")
-    sys.exit(0)
-   
-print(f"Number of rows in file: {len(lines)}")
+    try:
+        if len(sys.argv) > 1:
+            float(sys.argv[1])
+            print("There is no specified text to process")
+            sys.exit(0)
+    except ValueError:
+        input_file = sys.argv[1]
 
-# Punctuation marks processed
-test_text = [clear_endbreak_line(process_line2(elem, puncts=PUNCTS)) for elem in lines]
-print("Done processing the text")
+    workers = get_option(sys.argv, "--workers", os.cpu_count() or 1, int)
+    chunk_size = get_option(sys.argv, "--chunk-size", LINES_PER_CHUNK, int)
+    shard_lines = get_option(sys.argv, "--shard-lines", None, int)
 
-with open(sys.argv[2] + "/processed_text.test.txt", "w", encoding="utf-8") as test_file:
-    for item in test_text:
-        test_file.write("%s\n" % item)
+    # Punctuation marks processed (in chunks, written as soon as they are processed)
+    with open(input_file, "r", encoding="utf-8") as file, ShardWriter(sys.argv[2], "test", shard_lines) as test_file:
+        for chunk in process_file(file, 2, workers, chunk_size):
+            for item in chunk:
+                test_file.write(item)
 
-print("Done saving files to data directory")
\ No newline at end of file
+    print(f"Number of rows in file: {test_file.num_lines}")
+    print("Done processing the text")
+    print("Done saving files to data directory")